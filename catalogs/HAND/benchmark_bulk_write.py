@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+
+import argparse
+from datetime import datetime
+import os
+import shutil
+import tempfile
+import time
+
+from pystac import (
+    STAC_IO,
+    Asset,
+    CatalogType,
+    Collection,
+    Extent,
+    Item,
+    SpatialExtent,
+    TemporalExtent,
+)
+from shapely.geometry import box, mapping
+
+from stac_utils.bulk_write import normalize_and_save
+
+
+def synthetic_collection(num_items):
+    """ Collection of num_items HUC-like Items with the same assets as the HAND catalog """
+    dt = datetime(2020, 6, 1)
+    collection = Collection(
+        "synthetic",
+        "Synthetic collection for benchmarking STAC writers",
+        extent=Extent(
+            SpatialExtent([[-180, -90, 180, 90]]), TemporalExtent([[dt, None]])
+        ),
+    )
+    for i in range(num_items):
+        item_id = "{:06d}".format(i)
+        bounds = (-120 + (i % 600) * 0.1, 25 + (i // 600) * 0.01)
+        geom = box(bounds[0], bounds[1], bounds[0] + 0.1, bounds[1] + 0.01)
+        item = Item(item_id, mapping(geom), list(geom.bounds), dt, {})
+        for key in ["hand", "dd", "comid", "catchmask", "catchhuc", "hydrogeo"]:
+            item.add_asset(
+                key,
+                Asset(
+                    href="https://example.com/{}/{}{}.tif".format(
+                        item_id, item_id, key
+                    ),
+                    description="Synthetic {} asset".format(key),
+                    media_type="image/tiff; application=geotiff",
+                ),
+            )
+        collection.add_item(item)
+    return collection
+
+
+def directory_size(path):
+    return sum(
+        os.path.getsize(os.path.join(root, f))
+        for root, _, files in os.walk(path)
+        for f in files
+    )
+
+
+def benchmark(name, num_items, save):
+    """ Build a fresh synthetic collection and time save(collection, root_path) """
+    collection = synthetic_collection(num_items)
+    root_path = tempfile.mkdtemp(prefix="bulk-write-")
+    try:
+        start = time.perf_counter()
+        save(collection, root_path)
+        elapsed = time.perf_counter() - start
+        print(
+            "{:<32} {:>8.2f}s {:>10.0f} items/s {:>8.1f} MB".format(
+                name,
+                elapsed,
+                num_items / elapsed,
+                directory_size(root_path) / 1024 / 1024,
+            )
+        )
+    finally:
+        shutil.rmtree(root_path)
+
+
+def add_write_latency(latency):
+    """ Sleep for latency seconds before each STAC_IO write to mimic a network filesystem """
+    write_text_method = STAC_IO.write_text_method
+
+    def slow_write_text_method(uri, txt):
+        time.sleep(latency)
+        write_text_method(uri, txt)
+
+    STAC_IO.write_text_method = slow_write_text_method
+
+
+if __name__ == "__main__":
+    """ Compare pystac's normalize_and_save with stac_utils.bulk_write on a synthetic catalog
+
+    Set TMPDIR to benchmark writes to a network filesystem.
+
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--items", type=int, default=50000)
+    parser.add_argument("--workers", type=int, default=16)
+    parser.add_argument(
+        "--latency-ms",
+        type=float,
+        default=0,
+        help="Added latency per file written, to mimic S3 or a network filesystem",
+    )
+    args = parser.parse_args()
+    if args.latency_ms > 0:
+        add_write_latency(args.latency_ms / 1000)
+
+    print(
+        "Writing {} Items to {} with {}ms added latency".format(
+            args.items, tempfile.gettempdir(), args.latency_ms
+        )
+    )
+    benchmark(
+        "pystac normalize_and_save",
+        args.items,
+        lambda c, path: c.normalize_and_save(path, CatalogType.SELF_CONTAINED),
+    )
+    benchmark(
+        "bulk_write ({} workers)".format(args.workers),
+        args.items,
+        lambda c, path: normalize_and_save(c, path, workers=args.workers),
+    )
+    benchmark(
+        "bulk_write ({} workers, compact)".format(args.workers),
+        args.items,
+        lambda c, path: normalize_and_save(c, path, workers=args.workers, compact=True),
+    )
@@ -17,11 +17,28 @@ from pystac import (
     TemporalExtent,
 )
 
+from stac_utils.bulk_write import normalize_and_save
+from stac_utils.snapshot import catalog_items, write_snapshot
+
 hand_download_template = "https://cfim.ornl.gov/data/HAND/20200601/{huc6code}.zip"
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--root-uri", required=True)
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=16,
+        help="Number of threads to use for writing STAC Items",
+    )
+    parser.add_argument(
+        "--compact", action="store_true", help="Write STAC JSON without indentation"
+    )
+    parser.add_argument(
+        "--snapshot",
+        help="Also write every Item to this single file, as GeoParquet if it ends in .parquet "
+        "or else as newline delimited JSON",
+    )
     args = parser.parse_args()
 
     version_dt = datetime.combine(date.fromisoformat("2020-06-01"), datetime.min.time())
@@ -200,7 +217,15 @@ if __name__ == "__main__":
 
     # Save Complete Catalog
     root_path = "./data/catalog"
-    root_collection.normalize_and_save(
-        root_path, catalog_type=CatalogType.SELF_CONTAINED
+    normalize_and_save(
+        root_collection,
+        root_path,
+        catalog_type=CatalogType.SELF_CONTAINED,
+        workers=args.workers,
+        compact=args.compact,
     )
     print("Saved STAC Catalog {} to {}...".format(root_collection.id, root_path))
+
+    if args.snapshot:
+        write_snapshot(catalog_items(root_collection), args.snapshot)
+        print("Saved Item snapshot to {}...".format(args.snapshot))
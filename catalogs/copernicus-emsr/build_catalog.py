@@ -1,4 +1,5 @@
-from collections import namedtuple
+import argparse
+from collections import defaultdict, namedtuple
 from datetime import datetime, timedelta, timezone
 from itertools import groupby, zip_longest
 import logging
@@ -12,9 +13,10 @@ import xml.etree.ElementTree as ET
 
 import geopandas as gpd
 import pystac
-from shapely.geometry import GeometryCollection, Polygon, mapping, shape
+from shapely.geometry import Polygon, mapping
 
 from sentinel_hub import get_session, stac_search
+from stac_utils.snapshot import catalog_items, write_snapshot
 
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
@@ -50,8 +52,62 @@ def grouper(iterable, n, fillvalue=None):
     return zip_longest(*args, fillvalue=fillvalue)
 
 
+class ExtentAccumulator:
+    """ Running bbox and datetime range of the items added to a collection """
+
+    def __init__(self):
+        self.bbox = None
+        self.start_datetime = None
+        self.end_datetime = None
+
+    def add_item(self, item):
+        if item.bbox is not None:
+            if self.bbox is None:
+                self.bbox = list(item.bbox)
+            else:
+                self.bbox = [
+                    min(self.bbox[0], item.bbox[0]),
+                    min(self.bbox[1], item.bbox[1]),
+                    max(self.bbox[2], item.bbox[2]),
+                    max(self.bbox[3], item.bbox[3]),
+                ]
+        if isinstance(item.datetime, datetime):
+            if self.start_datetime is None or item.datetime < self.start_datetime:
+                self.start_datetime = item.datetime
+            if self.end_datetime is None or item.datetime > self.end_datetime:
+                self.end_datetime = item.datetime
+
+    def apply(self, collection, temporal=True):
+        """ Write the accumulated extent to collection, keeping any parts with no items
+
+        If temporal is False only the spatial extent is written.
+
+        """
+        if self.bbox is not None:
+            collection.extent.spatial = pystac.SpatialExtent(self.bbox)
+
+        if not temporal or self.start_datetime is None:
+            return
+        elif self.start_datetime == self.end_datetime:
+            collection.extent.temporal = pystac.TemporalExtent(
+                [(self.start_datetime, None)]
+            )
+        else:
+            collection.extent.temporal = pystac.TemporalExtent(
+                [(self.start_datetime, self.end_datetime)]
+            )
+
+
 def main():
     """ Pull Copernicus EU Rapid Mapping Activations data from the GeoRSS feed """
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--snapshot",
+        help="Also write every Item to this single file, as GeoParquet if it ends in .parquet "
+        "or else as newline delimited JSON",
+    )
+    args = parser.parse_args()
+
     sentinel_oauth_id = os.environ.get("SENTINELHUB_OAUTH_ID")
     sentinel_oauth_secret = os.environ.get("SENTINELHUB_OAUTH_SECRET")
     if sentinel_oauth_id is None:
@@ -198,8 +254,7 @@ def main():
             pystac.TemporalExtent(
                 [
                     (
-                        # TODO: Make this more specific by looping actual dts
-                        #       after ingest
+                        # Narrowed to the actual S2 datetimes once items are added
                         datetime(2019, 1, 1, 0, 0, 0, tzinfo=timezone.utc),
                         datetime(2020, 12, 31, 23, 59, 59, tzinfo=timezone.utc),
                     )
@@ -208,6 +263,7 @@ def main():
         ),
     )
     catalog.add_child(s2_collection)
+    collection_extents = defaultdict(ExtentAccumulator)
 
     # Loop Products grouped by event id, lookup Sentinel 2 matches for each
     # Product, and create STAC Items in catalog for any matches
@@ -260,6 +316,7 @@ def main():
                 },
             )
             event_collection.add_item(pystac_item)
+            collection_extents[event_collection.id].add_item(pystac_item)
             url_link = pystac.Link("alternate", p.product_link, media_type="text/html")
             pystac_item.add_link(url_link)
 
@@ -270,6 +327,7 @@ def main():
                 if s2_item is None:
                     s2_item = pystac.Item.from_dict(feature)
                     s2_collection.add_item(s2_item)
+                    collection_extents[s2_collection.id].add_item(s2_item)
 
                 s2_link = pystac.Link(
                     "data", s2_item, link_type=pystac.LinkType.RELATIVE
@@ -282,19 +340,23 @@ def main():
                 )
             )
 
-    # Set spatial extents
+    # Set extents accumulated while adding items
     for collection in catalog.get_children():
         if not isinstance(collection, pystac.Collection):
             continue
-        bounds = GeometryCollection(
-            [shape(s.geometry) for s in collection.get_all_items()]
-        ).bounds
-        collection.extent.spatial = pystac.SpatialExtent(bounds)
+        # Event collections keep their open ended interval from their first product
+        collection_extents[collection.id].apply(
+            collection, temporal=collection is s2_collection
+        )
 
     catalog_root = "./data/catalog"
     logger.info("Writing STAC Catalog to {}...".format(catalog_root))
     catalog.normalize_and_save(catalog_root, pystac.CatalogType.SELF_CONTAINED)
 
+    if args.snapshot:
+        logger.info("Writing Item snapshot to {}...".format(args.snapshot))
+        write_snapshot(catalog_items(catalog), args.snapshot)
+
 
 if __name__ == "__main__":
     main()
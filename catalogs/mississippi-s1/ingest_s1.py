@@ -10,7 +10,7 @@ from dateutil import rrule, relativedelta
 
 from request_builders import (
     get_sentinel_hub_session,
-    search_sentinelhub_s1,
+    SentinelHubSearchClient,
     create_batch_request,
     analyze_batch_request,
     initiate_batch_request,
@@ -43,6 +43,18 @@ def make_parser():
         type=str,
         help="The bucket that should contain the output of the SentinelHub Batch Ingests",
     )
+    parser.add_argument(
+        "--search-workers",
+        default=8,
+        type=int,
+        help="Number of SentinelHub catalog searches to run at once",
+    )
+    parser.add_argument(
+        "--search-rate",
+        default=5,
+        type=float,
+        help="Maximum number of SentinelHub catalog searches to start per second",
+    )
     return parser
 
 
@@ -73,14 +85,25 @@ if __name__ == "__main__":
     date_iter_start = datetime.combine(date(2016, 11, 1), time.min)
     date_iter_end = datetime.combine(date(2019, 12, 1), time.min)
 
+    months = []
     for dt_min in rrule.rrule(
         rrule.MONTHLY, dtstart=date_iter_start, until=date_iter_end
     ):
-        month_name = "{year}_{month}".format(year=dt_min.year, month=dt_min.month)
         dt_max = dt_min + relativedelta.relativedelta(
             day=31, hour=23, minute=59, second=59
         )
-        search_results = search_sentinelhub_s1(dt_min, dt_max, bbox, session)
+        months.append((dt_min, dt_max))
+
+    # Search for S1 scenes of every month at once
+    search_client = SentinelHubSearchClient(
+        session, workers=args.search_workers, rate=args.search_rate
+    )
+    month_search_results = search_client.search_s1_many(
+        [(dt_min, dt_max, bbox) for dt_min, dt_max in months]
+    )
+
+    for (dt_min, dt_max), search_results in zip(months, month_search_results):
+        month_name = "{year}_{month}".format(year=dt_min.year, month=dt_min.month)
         search_results = search_results.json()
 
         result_count = search_results["context"]["returned"]
@@ -1,10 +1,14 @@
+from concurrent.futures import ThreadPoolExecutor
 import datetime
 import json
 import logging
+import random
 import sys
+import threading
 import time
 
 import requests
+from requests.adapters import HTTPAdapter
 
 SENTINEL_HUB_HOSTNAME = "https://services.sentinel-hub.com"
 
@@ -67,6 +71,14 @@ def search_sentinelhub_s1(date_min, date_max, bbox, session):
                 ]
             }'
     """
+    return session.post(
+        "{}/api/v1/catalog/search".format(SENTINEL_HUB_HOSTNAME),
+        data=search_sentinelhub_s1_body(date_min, date_max, bbox),
+    )
+
+
+def search_sentinelhub_s1_body(date_min, date_max, bbox):
+    """ Returns JSON encoded body of the catalog search made by search_sentinelhub_s1 """
     datetime_str = "{}Z/{}Z".format(date_min.isoformat(), date_max.isoformat())
     parameters = {
         "limit": 300,
@@ -76,11 +88,92 @@ def search_sentinelhub_s1(date_min, date_max, bbox, session):
         "bbox": bbox,
     }
     logger.debug("search_sentinelhub_s1 params: {}".format(parameters))
-    encoded = json.dumps(parameters).encode("utf-8")
-    return session.post(
-        "{}/api/v1/catalog/search".format(SENTINEL_HUB_HOSTNAME),
-        data=encoded,
-    )
+    return json.dumps(parameters).encode("utf-8")
+
+
+class TokenBucket:
+    """ Thread safe rate limiter allowing rate calls per second, in bursts of up to capacity """
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self._tokens = capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        """ Block until a token is available, then take it """
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(
+                    self.capacity, self._tokens + (now - self._updated) * self.rate
+                )
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+class SentinelHubSearchClient:
+    """ Runs SentinelHub catalog searches concurrently on a single pooled session
+
+    Requests are limited to rate per second by a TokenBucket, so searches stay within the
+    account's rate limit however many run at once. Responses with a 429 or 5xx status, and
+    connection errors, are retried up to max_retries times with exponential backoff.
+
+    """
+
+    def __init__(self, session, workers=8, rate=5, max_retries=5, backoff=1):
+        self.session = session
+        self.workers = workers
+        self.max_retries = max_retries
+        self.backoff = backoff
+        # Bursts are limited to a second's worth of requests
+        self.rate_limiter = TokenBucket(rate, capacity=max(1, rate))
+        # Pool a connection for each worker, rather than requests' default of 10
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=workers)
+        self.session.mount(SENTINEL_HUB_HOSTNAME, adapter)
+
+    def post(self, url, data):
+        """ POST data to url, retrying rate limited and failed requests """
+        for attempt in range(self.max_retries + 1):
+            self.rate_limiter.acquire()
+            try:
+                response = self.session.post(url, data=data)
+            except requests.ConnectionError:
+                if attempt == self.max_retries:
+                    raise
+                logger.info("Connection error for {}, retrying".format(url))
+            else:
+                if response.status_code != 429 and response.status_code < 500:
+                    return response
+                if attempt == self.max_retries:
+                    return response
+                logger.info(
+                    "Status {} for {}, retrying".format(response.status_code, url)
+                )
+            # Jitter the backoff so that throttled workers don't all retry at once
+            time.sleep(self.backoff * 2 ** attempt * random.uniform(0.5, 1.5))
+
+    def search_s1(self, date_min, date_max, bbox):
+        """ Returns response of search_sentinelhub_s1 for date_min, date_max and bbox """
+        return self.post(
+            "{}/api/v1/catalog/search".format(SENTINEL_HUB_HOSTNAME),
+            search_sentinelhub_s1_body(date_min, date_max, bbox),
+        )
+
+    def search_s1_many(self, searches):
+        """ Returns list of search_s1 responses for each (date_min, date_max, bbox) of searches
+
+        Searches run concurrently on workers threads, and responses are in the order of
+        searches.
+
+        """
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            return list(executor.map(lambda search: self.search_s1(*search), searches))
 
 
 def create_batch_request(bbox, min_date, max_date, ingest_path, session):
@@ -16,6 +16,8 @@ from pystac import (
 )
 from shapely.geometry import Polygon, mapping
 
+from stac_utils.snapshot import catalog_items, write_snapshot
+
 
 if __name__ == "__main__":
     """Constructs STAC Catalog for surface water observed on a monthly basis around the Mississippi river
@@ -28,6 +30,11 @@ if __name__ == "__main__":
         required=True,
         help="Bucket+key path to a directory containing JRC surface water labels",
     )
+    parser.add_argument(
+        "--snapshot",
+        help="Also write every Item to this single file, as GeoParquet if it ends in .parquet "
+        "or else as newline delimited JSON",
+    )
     args = parser.parse_args()
 
     parsed_s3_path = urlparse(args.jrc_monthly_root_s3)
@@ -104,4 +111,8 @@ if __name__ == "__main__":
     # Save Complete Catalog
     root_path = "./data/catalog"
     collection.normalize_and_save(root_path, catalog_type=CatalogType.SELF_CONTAINED)
-    print("Saved STAC Catalog {} to {}...".format(collection.id, root_path))
\ No newline at end of file
+    print("Saved STAC Catalog {} to {}...".format(collection.id, root_path))
+
+    if args.snapshot:
+        write_snapshot(catalog_items(collection), args.snapshot)
+        print("Saved Item snapshot to {}...".format(args.snapshot))
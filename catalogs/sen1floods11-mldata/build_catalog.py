@@ -2,38 +2,119 @@
 
 import argparse
 import csv
+import os
 
-import numpy as np
-from pystac import Catalog, CatalogType, Collection, Link, LinkType
+from pystac import STAC_IO, Catalog, CatalogType, Collection, Link, LinkType
+
+from stac_utils.snapshot import catalog_items, write_snapshot
 
 # Map of experiment name to collection name in sen1floods11 STAC catalog
 EXPERIMENT = {"s2weak": "NoQC", "s1weak": "S1Flood_NoQC", "hand": "QC_v2"}
-S1 = None
 
 
-def mapper(item):
-    """ Map STAC LabelItem to list of STAC Item images with labels as links.
+class ItemIndex:
+    """ Every Item of a collection, indexed by id and by absolute href
+
+    Items are read once, in a single pass over the collection's item links. They are read
+    directly rather than resolved through the root catalog's cache, which is keyed by id and so
+    conflates S1 chips with the S1 weak labels that share their ids. The root is still passed
+    when reading so common properties are merged from the already loaded collection instead of
+    re-reading the collection JSON for every Item.
+
+    """
+
+    def __init__(self, collection):
+        self.by_id = {}
+        self.by_href = {}
+        root = collection.get_root()
+        for link in collection.get_links("item"):
+            href = link.get_absolute_href()
+            item = STAC_IO.read_stac_object(href, root=root)
+            self.by_id[item.id] = item
+            self.by_href[href] = item
+
+
+def chip_id(name):
+    """ Returns "country_eventid" chip id of an Item id or chip filename """
+    return "_".join(name.split("_")[0:-1])
+
+
+def load_split_csv(path):
+    """ Returns set of chip ids for the chips listed in a sen1floods11 split CSV
+
+    The first column of each row is a chip path, e.g. S1/Ghana_103272_S1.tif
+
+    """
+    with open(path) as csvfile:
+        return {chip_id(row[0].split("/")[1]) for row in csv.reader(csvfile)}
+
+
+class ItemSplits:
+    """ Assigns Items to the training, validation and test_<i> splits of an experiment
+
+    Chips in the validation CSV are validation chips and chips in the i-th test CSV are test_i
+    chips, so a chip may be in more than one test split. All other chips are training chips.
+    Bolivia is held out of training and validation.
+
+    """
+
+    def __init__(self, valid_set, test_sets):
+        self.valid_set = valid_set
+        self.test_sets = test_sets
+        self.any_test_set = set().union(*test_sets)
+
+    @property
+    def names(self):
+        return ["training", "validation"] + [
+            "test_{}".format(i) for i in range(len(self.test_sets))
+        ]
+
+    def splits(self, item):
+        """ Returns list of the names of the splits item is in """
+        item_chip_id = chip_id(item.id)
+        bolivia = "Bolivia" in item.id
+        splits = []
+        if item_chip_id in self.valid_set and not bolivia:
+            splits.append("validation")
+        elif item_chip_id not in self.any_test_set and not bolivia:
+            splits.append("training")
+        for i, test_set in enumerate(self.test_sets):
+            if item_chip_id in test_set:
+                splits.append("test_{}".format(i))
+        return splits
+
+    def partition(self, items):
+        """ Returns dict of split name -> list of items in it, in a single pass over items """
+        partition = {name: [] for name in self.names}
+        for item in items:
+            for split in self.splits(item):
+                partition[split].append(item)
+        return partition
+
+
+def mapper(item, s1_index):
+    """ Map STAC LabelItem to STAC Item images with labels as links, yielding each image.
 
     This is a one to many mapping because each label item could be sourced
-    from multiple image scenes.
+    from multiple image scenes. Source links are looked up in s1_index, an
+    ItemIndex of the S1 collection, rather than read one by one.
 
     """
-    global S1
-    source_links = list(filter(lambda l: l.rel == "source", item.links))
-    for link in source_links:
-        link.resolve_stac_object()
+    source_hrefs = [
+        link.get_absolute_href() for link in item.links if link.rel == "source"
+    ]
+    # Images are only cloned as they are yielded
     source_items = [
-        link.target.clone() for link in source_links if "_S1" in link.target.id
+        s1_index.by_href[href] for href in source_hrefs if href in s1_index.by_href
     ]
     if len(source_items) == 0:
         print("WARNING: No source images for {}".format(item.id))
         item_id = "_".join(item.id.split("_")[0:-1])
-        if S1 is None:
-            root_link = list(filter(lambda l: l.rel == "root", item.links))[0]
-            S1 = list(root_link.target.get_child("S1").get_items())
-        source_items = [i.clone() for i in S1 if i.id == f"{item_id}_S1"]
+        s1_item = s1_index.by_id.get(f"{item_id}_S1", None)
+        source_items = [s1_item] if s1_item is not None else []
 
     for source_item in source_items:
+        source_item = source_item.clone()
         label_asset = item.assets["labels"]
         # Remove label item source links to avoid recursion -- we're inverting
         # the label / item relationship.
@@ -46,17 +127,53 @@ def mapper(item):
                 media_type=label_asset.media_type,
             ).set_owner(source_item)
         ]
+        yield source_item
 
-    return source_items
+
+def add_split_collections(
+    mldata_catalog, split, extent, label_items, imagery_label_items, s1_index
+):
+    """ Add the <split>_labels and <split>_imagery collections to mldata_catalog
+
+    The labels collection gets a copy of each of label_items, and the imagery collection gets
+    the S1 images of imagery_label_items, linked to their labels. Test splits are numbered, so
+    test_0 is added as test_labels_0 and test_imagery_0.
+
+    """
+    name, _, number = split.partition("_")
+    suffix = "_{}".format(number) if number else ""
+    imagery_collection = Collection(
+        "{}_imagery{}".format(name, suffix),
+        "{} items for experiment".format(name),
+        extent,
+    )
+    labels_collection = Collection(
+        "{}_labels{}".format(name, suffix),
+        "labels for scenes in the {} collection".format(name),
+        extent,
+    )
+    mldata_catalog.add_child(labels_collection)
+    labels_collection.add_items(i.clone() for i in label_items)
+    mldata_catalog.add_child(imagery_collection)
+    # Images are added as mapper yields them, rather than collecting them in a list first
+    imagery_collection.add_items(
+        image for i in imagery_label_items for image in mapper(i.clone(), s1_index)
+    )
+    print(
+        "Added {} items to {} catalog{}".format(
+            len(imagery_label_items), name, " {}".format(number) if number else ""
+        )
+    )
 
 
 def make_parser():
     parser = argparse.ArgumentParser()
     parser.add_argument(
         "experiment",
-        choices=EXPERIMENT.keys(),
+        choices=[*EXPERIMENT.keys(), "all"],
         type=str,
-        help="Experiment to generate. One of {}".format(set(EXPERIMENT.keys())),
+        help="Experiment to generate. One of {}, or all to generate every experiment from a "
+        "single read of the sen1floods11 catalog".format(set(EXPERIMENT.keys())),
     )
     parser.add_argument(
         "--valid-csv",
@@ -73,61 +190,34 @@ def make_parser():
         type=str,
         help="The CSVs from which to take the list of training images",
     )
+    parser.add_argument(
+        "--snapshot",
+        help="Also write every Item to this single file, as GeoParquet if it ends in .parquet "
+        "or else as newline delimited JSON. With all, each experiment is written to its own "
+        "file, e.g. items_hand.parquet for items.parquet",
+    )
     return parser
 
 
-def main():
-    parser = make_parser()
-    args = parser.parse_args()
+def build_mldata_catalog(catalog, experiment, item_splits, s1_index, partitions):
+    """ Returns the mldata Catalog for experiment, built from the sen1floods11 catalog
 
-    valid_set = set()
-    with open(args.valid_csv) as csvfile:
-        for row in csv.reader(csvfile):
-            name = row[0].split("/")[1]
-            name = "_".join(name.split("_")[0:-1])
-            valid_set.add(name)
-
-    test_sets = []
-    any_test_set = set()
-    for test_csv in args.test_csvs:
-        test_set = set()
-        with open(test_csv) as csvfile:
-            for row in csv.reader(csvfile):
-                name = row[0].split("/")[1]
-                name = "_".join(name.split("_")[0:-1])
-                test_set.add(name)
-                any_test_set.add(name)
-        test_sets.append(test_set)
-
-    def yes_validation(item):
-        id = item.id
-        id = "_".join(id.split("_")[0:-1])
-        return id in valid_set and "Bolivia" not in item.id
-
-    def yes_test_i(i, item):
-        id = item.id
-        id = "_".join(id.split("_")[0:-1])
-        return id in test_sets[i]
-
-    def yes_any_test(item):
-        id = item.id
-        id = "_".join(id.split("_")[0:-1])
-        return id in any_test_set
-
-    def yes_training(item):
-        return (
-            not yes_any_test(item)
-            and not yes_validation(item)
-            and "Bolivia" not in item.id
-        )
+    partitions is a dict of label collection id -> ItemSplits.partition of its Items, which is
+    filled in as label collections are first needed so experiments can share them.
 
-    catalog = Catalog.from_file("./data/catalog/catalog.json")
+    """
 
-    experiment = args.experiment
-    label_collection_id = EXPERIMENT[experiment]
-    label_collection = catalog.get_child(label_collection_id)
-    test_label_collection_id = EXPERIMENT["hand"]
-    test_label_collection = catalog.get_child(test_label_collection_id)
+    def label_collection_partition(collection_id):
+        if collection_id not in partitions:
+            partitions[collection_id] = item_splits.partition(
+                catalog_items(catalog.get_child(collection_id))
+            )
+        return partitions[collection_id]
+
+    label_collection = catalog.get_child(EXPERIMENT[experiment])
+    label_items = label_collection_partition(EXPERIMENT[experiment])
+    test_label_collection = catalog.get_child(EXPERIMENT["hand"])
+    test_label_items = label_collection_partition(EXPERIMENT["hand"])
 
     # Top-Level
     mldata_catalog = Catalog(
@@ -138,78 +228,73 @@ def main():
     )
 
     # Training Imagery and Labels
-    training_imagery_collection = Collection(
-        "training_imagery", "training items for experiment", label_collection.extent
-    )
-    training_labels_collection = Collection(
-        "training_labels",
-        "labels for scenes in the training collection",
+    add_split_collections(
+        mldata_catalog,
+        "training",
         label_collection.extent,
+        label_items["training"],
+        label_items["training"],
+        s1_index,
     )
-    training_label_items = [
-        i.clone() for i in label_collection.get_items() if yes_training(i)
-    ]
-    mldata_catalog.add_child(training_labels_collection)
-    training_labels_collection.add_items(
-        [i.clone() for i in label_collection.get_items() if yes_training(i)]
-    )
-    mldata_catalog.add_child(training_imagery_collection)
-    training_imagery_items = np.array(list(map(mapper, training_label_items))).flatten()
-    training_imagery_collection.add_items(training_imagery_items)
-    print("Added {} items to training catalog".format(len(training_label_items)))
 
     # Validation Imagery and Labels
-    validation_imagery_collection = Collection(
-        "validation_imagery",
-        "validation items for experiment",
+    add_split_collections(
+        mldata_catalog,
+        "validation",
         test_label_collection.extent,
+        label_items["validation"],
+        test_label_items["validation"],
+        s1_index,
     )
-    validation_labels_collection = Collection(
-        "validation_labels",
-        "labels for scenes in the validation collection",
-        test_label_collection.extent,
-    )
-    validation_label_items = [
-        i.clone() for i in test_label_collection.get_items() if yes_validation(i)
-    ]
-    mldata_catalog.add_child(validation_labels_collection)
-    validation_labels_collection.add_items(
-        [i.clone() for i in label_collection.get_items() if yes_validation(i)]
-    )
-    mldata_catalog.add_child(validation_imagery_collection)
-    validation_imagery_items = np.array(
-        list(map(mapper, validation_label_items))
-    ).flatten()
-    validation_imagery_collection.add_items(validation_imagery_items)
-    print("Added {} items to validation catalog".format(len(validation_label_items)))
 
     # Test Imagery and Labels
-    for i in range(len(test_sets)):
-        test_imagery_collection = Collection(
-            "test_imagery_{}".format(i),
-            "test items for experiment",
+    for i in range(len(item_splits.test_sets)):
+        split = "test_{}".format(i)
+        add_split_collections(
+            mldata_catalog,
+            split,
             test_label_collection.extent,
+            label_items[split],
+            test_label_items[split],
+            s1_index,
         )
-        test_labels_collection = Collection(
-            "test_labels_{}".format(i),
-            "labels for scenes in the test collection",
-            test_label_collection.extent,
-        )
-        test_label_items = [
-            j.clone() for j in test_label_collection.get_items() if yes_test_i(i, j)
-        ]
-        mldata_catalog.add_child(test_labels_collection)
-        test_labels_collection.add_items(
-            [j.clone() for j in label_collection.get_items() if yes_test_i(i, j)]
+
+    return mldata_catalog
+
+
+def main():
+    parser = make_parser()
+    args = parser.parse_args()
+
+    valid_set = load_split_csv(args.valid_csv)
+    test_sets = [load_split_csv(test_csv) for test_csv in args.test_csvs]
+    item_splits = ItemSplits(valid_set, test_sets)
+
+    catalog = Catalog.from_file("./data/catalog/catalog.json")
+    s1_index = ItemIndex(catalog.get_child("S1"))
+
+    experiments = list(EXPERIMENT) if args.experiment == "all" else [args.experiment]
+    partitions = {}
+    for experiment in experiments:
+        print("Building {} experiment...".format(experiment))
+        mldata_catalog = build_mldata_catalog(
+            catalog, experiment, item_splits, s1_index, partitions
         )
-        mldata_catalog.add_child(test_imagery_collection)
-        test_imagery_items = np.array(list(map(mapper, test_label_items))).flatten()
-        test_imagery_collection.add_items(test_imagery_items)
-        print("Added {} items to test catalog {}".format(len(test_label_items), i))
-
-    print("Saving catalog...")
-    mldata_catalog.normalize_hrefs("./data/mldata_{}".format(experiment))
-    mldata_catalog.save(CatalogType.SELF_CONTAINED)
+
+        print("Saving catalog...")
+        mldata_catalog.normalize_hrefs("./data/mldata_{}".format(experiment))
+        mldata_catalog.save(CatalogType.SELF_CONTAINED)
+
+        if args.snapshot:
+            snapshot = args.snapshot
+            if args.experiment == "all":
+                root, ext = os.path.splitext(snapshot)
+                snapshot = "{}_{}{}".format(root, experiment, ext)
+            print("Saving Item snapshot...")
+            write_snapshot(catalog_items(mldata_catalog), snapshot)
+
+        # Release this experiment's Items before building the next
+        del mldata_catalog
 
 
 if __name__ == "__main__":
@@ -28,15 +28,7 @@ else
 fi
 
 echo "Generating catalogs (this may take awhile)..."
-python3 build_catalog.py hand \
-    --valid-csv ./data/flood_valid_data.csv \
-    --test-csvs ./data/flood_test_data.csv \
-    --test-csvs ./data/flood_bolivia_data.csv
-python3 build_catalog.py s1weak \
-    --valid-csv ./data/flood_valid_data.csv \
-    --test-csvs ./data/flood_test_data.csv \
-    --test-csvs ./data/flood_bolivia_data.csv
-python3 build_catalog.py s2weak \
+python3 build_catalog.py all \
     --valid-csv ./data/flood_valid_data.csv \
     --test-csvs ./data/flood_test_data.csv \
     --test-csvs ./data/flood_bolivia_data.csv
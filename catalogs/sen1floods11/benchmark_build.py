@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+
+import argparse
+from contextlib import redirect_stdout
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+
+from synthetic_bucket import write_synthetic_bucket
+
+
+def process_bytes_read():
+    """ Bytes this process has read through read syscalls, or None if not on Linux
+
+    Includes every read made by the process, though for a build these are almost all chip
+    header reads.
+
+    """
+    try:
+        with open("/proc/self/io") as f:
+            for line in f:
+                if line.startswith("rchar:"):
+                    return int(line.split()[1])
+    except FileNotFoundError:
+        return None
+
+
+def run_build(work_path, build_args):
+    """ Run build_catalog.main(build_args) with work_path as the working directory
+
+    Runs in a fresh process so each build starts with empty module level caches.
+
+    """
+    os.chdir(work_path)
+    import build_catalog
+
+    bytes_before = process_bytes_read()
+    start = time.perf_counter()
+    with open(os.devnull, "w") as devnull, redirect_stdout(devnull):
+        build_catalog.main(build_args)
+    elapsed = time.perf_counter() - start
+    bytes_after = process_bytes_read()
+    return {
+        "seconds": elapsed,
+        "items": build_catalog.BUILD_STATS["items"],
+        "header_reads": build_catalog.BUILD_STATS["header_reads"],
+        "bytes_read": None if bytes_before is None else bytes_after - bytes_before,
+    }
+
+
+def benchmark(num_chips, build_args, keep=False):
+    work_path = tempfile.mkdtemp(prefix="sen1floods11-benchmark-")
+    try:
+        bucket_path = os.path.join(work_path, "bucket")
+        num_files = write_synthetic_bucket(bucket_path, num_chips)
+        build_args = ["--local-bucket", bucket_path] + build_args
+        # spawn rather than fork so build_catalog is imported fresh for every build
+        with multiprocessing.get_context("spawn").Pool(1) as pool:
+            stats = pool.apply(run_build, (work_path, build_args))
+        print(
+            "{:>8} {:>8} {:>8.1f}s {:>10.0f} {:>12} {:>14}".format(
+                num_chips,
+                num_files,
+                stats["seconds"],
+                stats["items"] / stats["seconds"],
+                stats["header_reads"],
+                "n/a" if stats["bytes_read"] is None else stats["bytes_read"],
+            )
+        )
+    finally:
+        if keep:
+            print("Kept {}".format(work_path))
+        else:
+            shutil.rmtree(work_path)
+
+
+if __name__ == "__main__":
+    """ Benchmark build_catalog.py against synthetic buckets of increasing size
+
+    Reports build time, Items built per second, chip headers read and bytes read for each
+    size, so scaling regressions show up without access to s3://sen1floods11-data.
+
+    """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chips", type=int, nargs="+", default=[1000, 10000, 100000])
+    parser.add_argument("--workers", type=int, default=16)
+    parser.add_argument(
+        "--keep",
+        action="store_true",
+        help="Keep the synthetic bucket and catalog of each run",
+    )
+    args = parser.parse_args()
+
+    print(
+        "{:>8} {:>8} {:>9} {:>10} {:>12} {:>14}".format(
+            "chips", "files", "time", "items/s", "header reads", "bytes read"
+        )
+    )
+    for num_chips in args.chips:
+        benchmark(num_chips, ["--workers", str(args.workers)], keep=args.keep)
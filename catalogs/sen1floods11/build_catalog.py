@@ -1,13 +1,19 @@
 import argparse
-from datetime import datetime
+from collections import Counter, defaultdict, namedtuple
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime, timezone
+from functools import lru_cache
+from itertools import chain
 import json
 import os
+import queue
+import shutil
+import threading
 
 import click
 from pystac import (
     Asset,
     Catalog,
-    CatalogType,
     Collection,
     Extensions,
     Extent,
@@ -18,99 +24,566 @@ from pystac import (
     TemporalExtent,
 )
 from pystac.extensions.label import LabelClasses, LabelType
-import rasterio
-from shapely.geometry import GeometryCollection, box, shape
+from shapely.geometry import box, shape
 
-from storage.cloud_storage import S3Storage
+from build_manifest import BuildManifest
+from chip_cache import ChipHeader, ChipHeaderCache
+from chip_splits import SPLITS, ChipSplits
+from source_items import SourceItemRegistry
+from stac_utils.bulk_write import save_object_json, save_objects, self_links_first
+from stac_utils.snapshot import catalog_items, write_snapshot
+from storage.cloud_storage import FileStorage, S3Storage
+
+
+# Every folder in the sen1floods11-data bucket that contains chips we turn into STAC Items,
+# mapped to the id of the collection its chips are added to
+CHIP_PREFIXES = {
+    "S1/": "S1",
+    "S1_NoQC/": "S1",
+    "S2/": "S2",
+    "S2_NoQC/": "S2",
+    "S1Flood_NoQC/": "S1Flood_NoQC",
+    "NoQC/": "NoQC",
+    "QC_v2/": "QC_v2",
+    "Perm/": "Perm",
+    "S1Flood/": "S1Flood",
+}
 
 
 def chip_cache_id(country, event_id):
     return "{}_{}".format(country, event_id)
 
 
+def chip_uri_parts(uri):
+    """ Returns (item_id, country, event_id) parsed from a chip uri """
+    item_id = os.path.basename(uri).split(".")[0]
+    country, event_id, *_ = item_id.split("_")
+    return item_id, country, event_id
+
+
+# Counts of work done by the build, e.g. "items" added and chip "header_reads"
+BUILD_STATS = Counter()
+BUILD_STATS_LOCK = threading.Lock()
+
+
+def count_build_stat(name, count=1):
+    with BUILD_STATS_LOCK:
+        BUILD_STATS[name] += count
+
+
 # Remote Rasterio reads for bbox take forever. We can optimize by caching bbox for a given
-# chip after its first read as all chips with the same country+event_id have the same bbox
+# chip after its first read as all chips with the same country+event_id have the same bbox.
+# Values are Futures so reads can be started as soon as a chip is listed.
 CHIP_BBOX_CACHE = {}
+# Every object listed for each key of CHIP_BBOX_CACHE
+CHIP_BBOX_OBJECTS = defaultdict(list)
+CHIP_BBOX_LOCK = threading.Lock()
+
+# Chip headers persisted between runs. Only objects with a new ETag or size are read again.
+CHIP_HEADER_CACHE = ChipHeaderCache("./data/chip_headers.sqlite")
 
-# pystac walks to find source sentinel chips also take forever. So lets just cache refs to them
-# here instead since we visit and construct them all before we need to reference them in the
-# associate LabelItems
-SENTINEL_CHIP_ITEM_CACHE = {
-    "S1": {},
-    "S2": {},
-}
 
+# LabelItems link to the sentinel chip Items they label by id and href, which are recorded here
+# as sentinel chip Items are added. Saved with each sentinel collection.
+SOURCE_ITEMS = SourceItemRegistry("./data/source_items.json")
 
-def get_chip_bbox(uri, country, event_id):
+
+# Storage chips are listed from and their headers read through. Set by main.
+CHIP_STORAGE = None
+
+
+def read_chip_header(obj):
+    """ Read ChipHeader from the GeoTIFF header of StorageObject obj """
+    return ChipHeader(*CHIP_STORAGE.read_geotiff_header(obj.uri))
+
+
+def get_chip_header(obj):
+    """ Returns ChipHeader for StorageObject obj, reading it only if not in CHIP_HEADER_CACHE """
+    header = CHIP_HEADER_CACHE.get(obj)
+    if header is None:
+        header = read_chip_header(obj)
+        count_build_stat("header_reads")
+        CHIP_HEADER_CACHE.put(obj, header)
+    return header
+
+
+def read_chip_bbox(cache_key):
+    """ Returns bbox for the chips listed for cache_key
+
+    Uses the header of any object listed for cache_key so far that is current in
+    CHIP_HEADER_CACHE, and only reads the header of the first object listed if there is none.
+
+    """
+    with CHIP_BBOX_LOCK:
+        objects = list(CHIP_BBOX_OBJECTS[cache_key])
+    for obj in objects:
+        header = CHIP_HEADER_CACHE.get(obj)
+        if header is not None:
+            return header.bounds
+    return get_chip_header(objects[0]).bounds
+
+
+def request_chip_bbox(obj, executor):
+    """ Start reading the bbox for chip obj on executor unless it was already requested
+
+    Requests are deduplicated by country + event_id, so each bbox is read at most once
+    regardless of how many folders contain a chip for that event.
+
+    """
+    _, country, event_id = chip_uri_parts(obj.uri)
     cache_key = chip_cache_id(country, event_id)
-    bbox = CHIP_BBOX_CACHE.get(cache_key, None)
-    if bbox is None:
-        with rasterio.open(uri) as src:
-            new_bbox = list(src.bounds)
-            CHIP_BBOX_CACHE[cache_key] = new_bbox
-            return new_bbox
-    else:
-        return bbox
+    with CHIP_BBOX_LOCK:
+        CHIP_BBOX_OBJECTS[cache_key].append(obj)
+        if cache_key not in CHIP_BBOX_CACHE:
+            CHIP_BBOX_CACHE[cache_key] = executor.submit(read_chip_bbox, cache_key)
+
+
+def get_chip_bbox(obj, country, event_id):
+    """ Returns bbox for chip obj, waiting for the read started by request_chip_bbox if any """
+    cache_key = chip_cache_id(country, event_id)
+    with CHIP_BBOX_LOCK:
+        future = CHIP_BBOX_CACHE.get(cache_key, None)
+    if future is None:
+        future = Future()
+        future.set_result(get_chip_header(obj).bounds)
+        with CHIP_BBOX_LOCK:
+            CHIP_BBOX_CACHE.setdefault(cache_key, future)
+    return future.result()
+
+
+class ChipListingError(Exception):
+    """ A chip prefix was not completely listed, so its collection can't be saved """
+
+    pass
+
+
+def stream_chip_objects(storage, prefixes, debug=False):
+    """ List prefixes of storage concurrently and yield (prefix, StorageObject) as they arrive
+
+    (prefix, None) is yielded once all objects of prefix have been yielded. If a prefix fails
+    to list, its error is raised instead.
+
+    """
+    work_queue = queue.Queue()
+
+    def list_prefix(prefix):
+        try:
+            for count, obj in enumerate(storage.ls_objects(prefix)):
+                if debug and count >= 10:
+                    break
+                work_queue.put((prefix, obj))
+        except BaseException as e:
+            work_queue.put((prefix, e))
+            raise
+        work_queue.put((prefix, None))
+
+    with ThreadPoolExecutor(max_workers=len(prefixes)) as executor:
+        futures = [executor.submit(list_prefix, prefix) for prefix in prefixes]
+        remaining = len(prefixes)
+        while remaining > 0:
+            prefix, obj = work_queue.get()
+            if isinstance(obj, BaseException):
+                raise obj
+            if obj is None:
+                remaining -= 1
+            yield prefix, obj
+        for future in futures:
+            future.result()
+
+
+# Misnamed country ids in tiffs mapped to their location in chips_metadata.geojson
+COUNTRY_ALIASES = {"Mekong": "Cambodia"}
+
+# Parsed properties of a single location feature in chips_metadata.geojson
+ChipLocation = namedtuple("ChipLocation", ["s1_date", "s2_date", "footprint"])
+
+CHIP_METADATA_PATH = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "chips_metadata.geojson"
+)
+
+
+@lru_cache(maxsize=None)
+def load_chip_metadata(path=CHIP_METADATA_PATH):
+    """ Returns dict of country -> ChipLocation, parsed from path once per run """
+    with open(path) as f:
+        features = json.load(f)["features"]
+    chip_metadata = {
+        feature["properties"]["location"]: ChipLocation(
+            datetime.strptime(feature["properties"]["s1_date"], "%Y/%m/%d"),
+            datetime.strptime(feature["properties"]["s2_date"], "%Y/%m/%d"),
+            shape(feature["geometry"]),
+        )
+        for feature in features
+    }
+    for alias, location in COUNTRY_ALIASES.items():
+        if location in chip_metadata:
+            chip_metadata[alias] = chip_metadata[location]
+    return chip_metadata
 
 
 def image_date_for_country(sentinel_version, country):
     """ Returns Datetime for country from metadata or None if no result """
-    # Misnamed country id in tiffs -- here's a nice hack to get info from metadata...
-    if country == "Mekong":
-        country = "Cambodia"
-    cnn_chips_geojson_file = "./chips_metadata.geojson"
-    f = open(cnn_chips_geojson_file)
-    chip_metadata = json.load(f)
-    f.close()
-    metadata = next(
-        (
-            x
-            for x in chip_metadata["features"]
-            if x["properties"]["location"] == country
-        ),
-        None,
-    )
-    if metadata is not None:
-        date_field = "{}_date".format(sentinel_version.lower())
-        return datetime.strptime(metadata["properties"][date_field], "%Y/%m/%d")
+    location = load_chip_metadata().get(country, None)
+    if location is not None:
+        return getattr(location, "{}_date".format(sentinel_version.lower()))
     else:
         print("WARN: No image date for {} {}".format(sentinel_version, country))
         return None
 
 
+class ExtentAccumulator:
+    """ Running bbox and datetime range of the items added to a collection """
+
+    def __init__(self):
+        self.bbox = None
+        self.start_datetime = None
+        self.end_datetime = None
+
+    def add_item(self, item):
+        if item.bbox is not None:
+            if self.bbox is None:
+                self.bbox = list(item.bbox)
+            else:
+                self.bbox = [
+                    min(self.bbox[0], item.bbox[0]),
+                    min(self.bbox[1], item.bbox[1]),
+                    max(self.bbox[2], item.bbox[2]),
+                    max(self.bbox[3], item.bbox[3]),
+                ]
+        if isinstance(item.datetime, datetime):
+            # Items loaded from a saved catalog are UTC aware, new ones are naive (implicit UTC)
+            dt = item.datetime
+            if dt.tzinfo is None:
+                dt = dt.replace(tzinfo=timezone.utc)
+            if self.start_datetime is None or dt < self.start_datetime:
+                self.start_datetime = dt
+            if self.end_datetime is None or dt > self.end_datetime:
+                self.end_datetime = dt
+
+    def apply(self, collection):
+        """ Write the accumulated extent to collection """
+        if self.bbox is not None:
+            collection.extent.spatial = SpatialExtent(self.bbox)
+
+        if self.start_datetime is None:
+            print("WARN: {} has no TemporalExtent.".format(collection.id))
+            collection.extent.temporal = TemporalExtent(
+                [(datetime(1900, 1, 1, 0, 0, 0), None)]
+            )
+        elif self.start_datetime == self.end_datetime:
+            collection.extent.temporal = TemporalExtent([(self.start_datetime, None)])
+        else:
+            collection.extent.temporal = TemporalExtent(
+                [(self.start_datetime, self.end_datetime)]
+            )
+
+
+# Extent of the items added to each collection so far, keyed by collection id
+COLLECTION_EXTENTS = defaultdict(ExtentAccumulator)
+
+
+# ChipSplits deciding which split root catalog each Item is also linked from, if any
+CHIP_SPLITS = None
+# Root catalog of each split, and the split's copy of each collection keyed by collection id
+SPLIT_CATALOGS = {}
+SPLIT_COLLECTIONS = defaultdict(dict)
+
+
+def add_split_catalogs(catalog, chip_splits, root_path):
+    """ Create a root catalog in root_path/<split> for each split, with a copy of each collection
+
+    Collection copies link to the same Item JSON as the collections in catalog. Items are linked
+    from the copy of their collection in their split as they are added, so every split is built
+    in the same pass as catalog.
+
+    """
+    global CHIP_SPLITS
+    CHIP_SPLITS = chip_splits
+    for split in SPLITS:
+        split_catalog = Catalog(
+            "{}_{}".format(catalog.id, split),
+            "{} split of {}".format(split.capitalize(), catalog.id),
+            title="{} ({})".format(catalog.title, split),
+        )
+        for collection in catalog.get_children():
+            split_collection = Collection(
+                collection.id,
+                collection.description,
+                extent=Extent(SpatialExtent([None, None, None, None]), None),
+                stac_extensions=collection.stac_extensions,
+            )
+            split_catalog.add_child(split_collection)
+            SPLIT_COLLECTIONS[collection.id][split] = split_collection
+        split_catalog.normalize_hrefs(os.path.join(root_path, split))
+        SPLIT_CATALOGS[split] = split_catalog
+
+
+def split_add_item(collection, item):
+    """ Link item from the copy of collection in its split, if there are split catalogs """
+    if CHIP_SPLITS is None:
+        return
+    split = CHIP_SPLITS.split(item.properties["country"], item.properties["event_id"])
+    if split is not None:
+        SPLIT_COLLECTIONS[collection.id][split].add_link(Link.item(item))
+        COLLECTION_EXTENTS[(split, collection.id)].add_item(item)
+
+
+def collection_add_item(collection, item):
+    """ Add item to collection and accumulate its extent for collection_update_extents """
+    collection.add_item(item)
+    COLLECTION_EXTENTS[collection.id].add_item(item)
+    split_add_item(collection, item)
+    count_build_stat("items")
+    print("Collection {}: Added STAC Item {}".format(collection.id, item.id))
+
+
 def collection_update_extents(collection):
-    bounds = GeometryCollection(
-        [shape(s.geometry) for s in collection.get_all_items()]
-    ).bounds
-    collection.extent.spatial = SpatialExtent(bounds)
-
-    dates = {
-        i.datetime
-        for i in collection.get_all_items()
-        if isinstance(i.datetime, datetime)
-    }
-    if len(dates) == 1:
-        collection.extent.temporal = TemporalExtent([(next(iter(dates)), None)])
-    elif len(dates) > 1:
-        collection.extent.temporal = TemporalExtent([(min(dates), max(dates))])
-    else:
-        print("WARN: {} has no TemporalExtent. Dates: {}".format(collection.id, dates))
-        collection.extent.temporal = TemporalExtent(
-            [(datetime(1900, 1, 1, 0, 0, 0), None)]
+    COLLECTION_EXTENTS[collection.id].apply(collection)
+    for split, split_collection in SPLIT_COLLECTIONS[collection.id].items():
+        COLLECTION_EXTENTS[(split, collection.id)].apply(split_collection)
+
+
+def item_relative_href(collection_id, item_id):
+    """ Returns the href Item item_id is saved to in collection_id, relative to the root """
+    return os.path.join(collection_id, item_id, "{}.json".format(item_id))
+
+
+def item_href(root_path, collection_id, item_id):
+    """ Returns the absolute href Item item_id is saved to in collection_id under root_path """
+    return os.path.join(
+        os.path.abspath(root_path), item_relative_href(collection_id, item_id)
+    )
+
+
+def add_source_item(sentinel_version, collection, item, country, event_id):
+    """ Record sentinel chip item in SOURCE_ITEMS so LabelItems can link to it """
+    SOURCE_ITEMS.add(
+        sentinel_version.upper(),
+        country,
+        event_id,
+        item.id,
+        item_relative_href(collection.id, item.id),
+    )
+
+
+def relink_sources(catalog, collection, source_sensors):
+    """ Set the source links of every LabelItem in collection from the SOURCE_ITEMS of its sensors
+
+    Call once source_sensors, the sensors collection's links_func links to, are complete. New
+    LabelItems may link to a chip from a loaded SOURCE_ITEMS that was not listed again, and
+    LabelItems loaded from a previous build may link to a removed chip or miss a new one. Loaded
+    LabelItems whose links change are turned back into new Items so save_collection writes
+    them again.
+
+    """
+    root_href = catalog.get_self_href()
+    for item in (link.target for link in collection.links if link.rel == "item"):
+        _, country, event_id = chip_uri_parts(item.id)
+        sources = source_links_for_labels(
+            root_href,
+            [SOURCE_ITEMS.get(sensor, country, event_id) for sensor in source_sensors],
+            item,
         )
+        linked = [
+            os.path.normpath(link.get_absolute_href())
+            for link in item.links
+            if link.rel == "source"
+        ]
+        if linked == [os.path.normpath(link.target) for link in sources]:
+            continue
+        if item.get_self_href() is not None:
+            # Resolve links saved relative to the Item before it loses its self href
+            for link in item.links:
+                if isinstance(link.target, str):
+                    link.target = link.get_absolute_href()
+            item.remove_links("self")
+        item.links = sources + [link for link in item.links if link.rel != "source"]
+
+
+def collection_load_item(collection, obj, manifest, root_path, sentinel_version=None):
+    """ Add the Item saved for obj by a previous build to collection if it is up to date
+
+    Returns True if the saved Item was added, or False if obj needs a new Item. If
+    sentinel_version is set the Item is also added to SOURCE_ITEMS so new LabelItems can link
+    to it.
+
+    Saved Items are read without resolving their links. pystac resolves linked objects by id
+    and label chips share ids with the sentinel chips they label.
+
+    """
+    item_id, country, event_id = chip_uri_parts(obj.uri)
+    href = item_href(root_path, collection.id, item_id)
+    if not manifest.is_current(collection.id, obj) or not os.path.isfile(href):
+        return False
+    item = Item.from_file(href)
+    collection.add_item(item)
+    COLLECTION_EXTENTS[collection.id].add_item(item)
+    split_add_item(collection, item)
+    if sentinel_version is not None:
+        add_source_item(sentinel_version, collection, item, country, event_id)
+    return True
+
+
+# Collections are saved from several threads but share the root catalog and manifest
+CATALOG_SAVE_LOCK = threading.Lock()
+
+
+def queued_objects(object_queue):
+    """ Yield the StorageObjects put on object_queue until None, raising any error put on it """
+    for obj in iter(object_queue.get, None):
+        if isinstance(obj, BaseException):
+            raise obj
+        yield obj
+
+
+def save_collection(
+    catalog,
+    collection,
+    root_path,
+    manifest,
+    objects,
+    sentinel_version=None,
+    source_sensors=(),
+    workers=16,
+    compact=False,
+):
+    """ Save new Items in collection and the root catalog, then record objects in manifest
+
+    Items loaded by collection_load_item already have a self href and are unchanged on disk,
+    so only new Items are written, on a pool of workers threads. The copies of collection in
+    each split catalog are saved along with it. Saving each collection as soon
+    as it is built means a failed build can be resumed with --incremental. If sentinel_version
+    is set, SOURCE_ITEMS is saved with that sensor complete. The Items of chips that were in the
+    manifest but are not in objects are deleted from root_path.
 
+    Nothing is saved, and no manifest entries are recorded, unless every sensor in
+    source_sensors is complete. Otherwise LabelItems missing source links would count as
+    current in later builds.
 
-def collection_add_sentinel_chips(collection, uri_list, sentinel_version, debug=False):
-    """ Add sentinel images to a collection """
+    """
+    SOURCE_ITEMS.wait_complete(source_sensors)
+    new_items = []
+    # Not collection.get_items(), which resolves Items through the root catalog's cache by id
+    # and returns the label chip Item for a sentinel chip with the same id or vice versa
+    for item in (link.target for link in collection.links if link.rel == "item"):
+        if item.get_self_href() is None:
+            item.set_self_href(item_href(root_path, collection.id, item.id))
+            item.make_links_relative()
+            new_items.append(item)
+    split_collections = list(SPLIT_COLLECTIONS[collection.id].values())
+    for c in [collection] + split_collections:
+        c.make_links_relative()
+    with self_links_first([collection] + split_collections):
+        save_objects(new_items, workers=workers, compact=compact)
+        for c in [collection] + split_collections:
+            save_object_json(c, compact=compact)
+
+    with CATALOG_SAVE_LOCK:
+        for c in [catalog] + list(SPLIT_CATALOGS.values()):
+            c.make_links_relative()
+            save_object_json(c, compact=compact)
+        removed_item_ids = manifest.replace(
+            collection.id, [(obj, chip_uri_parts(obj.uri)[0]) for obj in objects]
+        )
+        manifest.save()
+        if sentinel_version is not None:
+            SOURCE_ITEMS.save(complete=[sentinel_version.upper()])
+        CHIP_HEADER_CACHE.commit()
+    # The collection no longer links them, so they would only be reachable by path
+    for item_id in removed_item_ids:
+        shutil.rmtree(
+            os.path.dirname(item_href(root_path, collection.id, item_id)),
+            ignore_errors=True,
+        )
+    print("Saved Collection {} to {}...".format(collection.id, root_path))
+
+
+def build_collection(
+    catalog,
+    collection,
+    objects,
+    manifest,
+    root_path,
+    add_items,
+    sentinel_version=None,
+    source_sensors=(),
+    workers=16,
+    compact=False,
+):
+    """ Build collection from the StorageObjects in objects and save it to root_path
+
+    Tifs with an up to date Item saved by a previous build are loaded from root_path, and
+    add_items(collection, objects) is called with the rest as they are listed.
+
+    If sentinel_version is set, the sensor is marked complete in SOURCE_ITEMS once the
+    collection is saved, or failed if the build raises. source_sensors are the sensors
+    LabelItems in collection link to, which must be saved before collection is. If one of them
+    fails this build raises SourceSensorError without saving anything. workers and compact are
+    passed to save_collection.
+
+    """
+    listed = []
+    loaded = []
+
+    def pending_objects():
+        for obj in objects:
+            if not obj.uri.endswith(".tif"):
+                continue
+            if obj.size == 0:
+                print("WARN: Skipping empty chip {}".format(obj.uri))
+                continue
+            listed.append(obj)
+            if collection_load_item(
+                collection, obj, manifest, root_path, sentinel_version
+            ):
+                loaded.append(obj)
+            else:
+                yield obj
+
+    try:
+        add_items(collection, pending_objects())
+        print(
+            "Collection {}: {} saved Items, {} new Items".format(
+                collection.id, len(loaded), len(listed) - len(loaded)
+            )
+        )
+        collection_update_extents(collection)
+        SOURCE_ITEMS.wait_complete(source_sensors)
+        if source_sensors:
+            relink_sources(catalog, collection, source_sensors)
+        if sentinel_version is not None:
+            SOURCE_ITEMS.prune(sentinel_version.upper())
+        save_collection(
+            catalog,
+            collection,
+            root_path,
+            manifest,
+            listed,
+            sentinel_version=sentinel_version,
+            source_sensors=source_sensors,
+            workers=workers,
+            compact=compact,
+        )
+    except BaseException:
+        # Don't let LabelItems be saved without the sources this build didn't add
+        if sentinel_version is not None:
+            SOURCE_ITEMS.fail(sentinel_version.upper())
+        raise
+    if sentinel_version is not None:
+        SOURCE_ITEMS.complete(sentinel_version.upper())
+
+
+def collection_add_sentinel_chips(collection, objects, sentinel_version, debug=False):
+    """ Add sentinel images in StorageObjects objects to a collection """
     if debug:
-        uri_list = list(uri_list)[:10]
-    for uri in uri_list:
+        objects = list(objects)[:10]
+    for obj in objects:
+        uri = obj.uri
 
         if not uri.endswith(".tif"):
             continue
 
-        item_id = os.path.basename(uri).split(".")[0]
-        country, event_id, *_ = item_id.split("_")
+        item_id, country, event_id = chip_uri_parts(uri)
         params = {}
         params["id"] = item_id
         params["collection"] = collection
@@ -118,10 +591,24 @@ def collection_add_sentinel_chips(collection, uri_list, sentinel_version, debug=
             "country": country,
             "event_id": event_id,
         }
-        params["bbox"] = get_chip_bbox(uri, country, event_id)
+        params["bbox"] = get_chip_bbox(obj, country, event_id)
         params["geometry"] = box(*params["bbox"]).__geo_interface__
 
         params["datetime"] = image_date_for_country(sentinel_version, country)
+        if params["datetime"] is None:
+            # Fall back to the acquisition time the chip was tagged with, if any
+            header_datetime = get_chip_header(obj).datetime
+            if header_datetime is not None:
+                try:
+                    params["datetime"] = datetime.strptime(
+                        header_datetime, "%Y:%m:%d %H:%M:%S"
+                    )
+                except ValueError:
+                    print(
+                        "WARN: Invalid TIFF DateTime {!r} for {}".format(
+                            header_datetime, uri
+                        )
+                    )
 
         # Create Tiff Item
         item = Item(**params)
@@ -129,17 +616,14 @@ def collection_add_sentinel_chips(collection, uri_list, sentinel_version, debug=
             href=uri, title="GeoTiff", media_type="image/tiff; application=geotiff"
         )
         item.add_asset(key="image", asset=asset)
-        SENTINEL_CHIP_ITEM_CACHE[sentinel_version.upper()][
-            chip_cache_id(country, event_id)
-        ] = item
-        collection.add_item(item)
-        print("Collection {}: Added STAC Item {}".format(collection.id, item.id))
+        add_source_item(sentinel_version, collection, item, country, event_id)
+        collection_add_item(collection, item)
 
 
 def label_collection_add_items(
     collection,
     root_catalog,
-    uri_list,
+    objects,
     links_func,
     label_description,
     label_type,
@@ -147,7 +631,7 @@ def label_collection_add_items(
     label_tasks=None,
     debug=False,
 ):
-    """ Add uri_list tif uris to collection as LabelItems
+    """ Add tifs in StorageObjects objects to collection as LabelItems
 
     root_catalog is the top level node in the STAC Catalog where the chips labeled by these tifs
     can be found. Required to correctly setup Links to the source chips.
@@ -165,13 +649,13 @@ def label_collection_add_items(
 
     """
     if debug:
-        uri_list = list(uri_list)[:10]
-    for uri in uri_list:
+        objects = list(objects)[:10]
+    for obj in objects:
+        uri = obj.uri
         if not uri.endswith(".tif"):
             continue
 
-        item_id = os.path.basename(uri).split(".")[0]
-        country, event_id, *_ = item_id.split("_")
+        item_id, country, event_id = chip_uri_parts(uri)
 
         params = {}
         params["id"] = item_id
@@ -182,7 +666,7 @@ def label_collection_add_items(
             "country": country,
             "event_id": event_id,
         }
-        params["bbox"] = get_chip_bbox(uri, country, event_id)
+        params["bbox"] = get_chip_bbox(obj, country, event_id)
         params["geometry"] = box(*params["bbox"]).__geo_interface__
 
         label_ext_params = {}
@@ -205,29 +689,35 @@ def label_collection_add_items(
 
         item.links = links_func(root_catalog, item, country, event_id)
 
-        collection.add_item(item)
-        print("Collection {}: Added STAC Item {}".format(collection.id, item.id))
+        collection_add_item(collection, item)
+
+
+def source_links_for_labels(root_href, sources, label_item):
+    """ Maps source chips to label_item "labels" via label extension "source" Links
 
+    sources are SourceItems, with hrefs relative to the root catalog at root_href. Links are
+    made relative to label_item when it is saved.
 
-def source_links_for_labels(items, label_item):
-    """ Maps input STAC Items (items) to label_item "labels" via label extension "source" Links """
+    """
+    root_dir = os.path.dirname(root_href)
     return [
         Link(
             "source",
-            o,
+            os.path.join(root_dir, source.href),
             link_type=LinkType.RELATIVE,
             media_type="image/tiff; application=geotiff",
             properties={"label:assets": "labels"},
         ).set_owner(label_item)
-        for o in items
-        if o is not None
+        for source in sources
+        if source is not None
     ]
 
 
 def sentinel1_links_func(root_catalog, label_item, country, event_id):
     """ links_func that looks up country + event id in only S1 """
     return source_links_for_labels(
-        [SENTINEL_CHIP_ITEM_CACHE["S1"].get(chip_cache_id(country, event_id), None)],
+        root_catalog.get_self_href(),
+        [SOURCE_ITEMS.get("S1", country, event_id)],
         label_item,
     )
 
@@ -235,24 +725,25 @@ def sentinel1_links_func(root_catalog, label_item, country, event_id):
 def sentinel2_links_func(root_catalog, label_item, country, event_id):
     """ links_func that looks up country + event id in only S2 """
     return source_links_for_labels(
-        [SENTINEL_CHIP_ITEM_CACHE["S2"].get(chip_cache_id(country, event_id), None)],
+        root_catalog.get_self_href(),
+        [SOURCE_ITEMS.get("S2", country, event_id)],
         label_item,
     )
 
 
 def sentinel1_sentinel2_links_func(root_catalog, label_item, country, event_id):
     """ links_func that looks up country + event id in both S1 and S2 """
-    cache_id = chip_cache_id(country, event_id)
     return source_links_for_labels(
+        root_catalog.get_self_href(),
         [
-            SENTINEL_CHIP_ITEM_CACHE["S1"].get(cache_id, None),
-            SENTINEL_CHIP_ITEM_CACHE["S2"].get(cache_id, None),
+            SOURCE_ITEMS.get("S1", country, event_id),
+            SOURCE_ITEMS.get("S2", country, event_id),
         ],
         label_item,
     )
 
 
-def main():
+def main(argv=None):
     """
 
 # The Data
@@ -263,7 +754,7 @@ def main():
 # The Catalog Outline
 
 ** We want to generate a root catalog that is all, or only training, or only validation items **
-^^^ Script should support this
+^^^ --valid-csv and --test-csvs add training and validation root catalogs in the same pass
 
 - Root Catalog
     - Collection: Sentinel 1 data chips
@@ -310,148 +801,282 @@ of the label datasets.
     """
     parser = argparse.ArgumentParser(description="Build STAC Catalog for sen1floods11")
     parser.add_argument("--debug", action="store_true")
-    args = parser.parse_args()
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="Update the catalog from a previous build, only adding new or changed chips",
+    )
+    parser.add_argument(
+        "--workers",
+        default=16,
+        type=int,
+        help="Number of threads to use for listing chips, reading chip bboxes and writing "
+        "STAC Items",
+    )
+    parser.add_argument(
+        "--compact", action="store_true", help="Write STAC JSON without indentation"
+    )
+    parser.add_argument(
+        "--snapshot",
+        help="Also write every Item to this single file, as GeoParquet if it ends in .parquet "
+        "or else as newline delimited JSON",
+    )
+    parser.add_argument(
+        "--valid-csv",
+        help="Also write training and validation root catalogs, taking validation chips from "
+        "this sen1floods11 split CSV",
+    )
+    parser.add_argument(
+        "--test-csvs",
+        nargs="+",
+        default=[],
+        help="sen1floods11 split CSVs of test chips, which are left out of both splits",
+    )
+    parser.add_argument(
+        "--local-bucket",
+        help="Read chips from this directory instead of s3://sen1floods11-data. It must have "
+        "the same folder layout as the bucket, e.g. a directory written by synthetic_bucket.py",
+    )
+    args = parser.parse_args(argv)
     debug = args.debug
 
-    storage = S3Storage("sen1floods11-data")
+    global CHIP_STORAGE, SOURCE_ITEMS
+    if args.local_bucket:
+        storage = FileStorage(args.local_bucket)
+    else:
+        # Listing and chip header reads each make up to args.workers requests at once
+        storage = S3Storage(
+            "sen1floods11-data", workers=args.workers, connections=2 * args.workers
+        )
+    CHIP_STORAGE = storage
 
     catalog_description = "Bonafilia, D., Tellman, B., Anderson, T., Issenberg, E. 2020. Sen1Floods11: a georeferenced dataset to train and test deep learning flood algorithms for Sentinel-1. The IEEE/CVF Conference on Computer Vision and Pattern Recognition (CVPR) Workshops, 2020, pp. 210-211. Available Open access at: http://openaccess.thecvf.com/content_CVPRW_2020/html/w11/Bonafilia_Sen1Floods11_A_Georeferenced_Dataset_to_Train_and_Test_Deep_Learning_CVPRW_2020_paper.html"  # noqa: E501
     catalog_title = "A georeferenced dataset to train and test deep learning flood algorithms for Sentinel-1"  # noqa: E501
 
+    root_path = "./catalog"
+    manifest_path = "./data/build_manifest.json"
+    if args.incremental:
+        manifest = BuildManifest.load(manifest_path)
+        # LabelItems link to the sentinel chip Items saved by the last build without waiting
+        # for S1 and S2 to be listed again
+        SOURCE_ITEMS = SourceItemRegistry.load(SOURCE_ITEMS.path)
+    else:
+        manifest = BuildManifest(manifest_path)
+
     catalog = Catalog("sen1floods11", catalog_description, title=catalog_title)
     print("Created Catalog {}".format(catalog.id))
 
-    # Build Sentinel 1 Collection
+    # Sentinel 1 Collection
     sentinel1 = Collection(
         "S1",
         "Sentinel-1 GRD Chips overlapping labeled data. IW mode, GRD product. See https://developers.google.com/earth-engine/sentinel1 for information on preprocessing",  # noqa: E501
         extent=Extent(SpatialExtent([None, None, None, None]), None),
     )
-    collection_add_sentinel_chips(sentinel1, storage.ls("S1/"), "s1", debug=debug)
-    collection_add_sentinel_chips(sentinel1, storage.ls("S1_NoQC/"), "s1", debug=debug)
-    collection_update_extents(sentinel1)
-    catalog.add_child(sentinel1)
 
-    # Build Sentinel 2 Collection
+    def sentinel1_add_items(collection, objects):
+        collection_add_sentinel_chips(collection, objects, "s1")
+
+    # Sentinel 2 Collection
     sentinel2 = Collection(
         "S2",
         "Sentinel-2 MSI L1C chips overlapping labeled data. Contains all spectral bands (1 - 12). Does not contain QA mask.",  # noqa: E501
         extent=Extent(SpatialExtent([None, None, None, None]), None),
     )
-    collection_add_sentinel_chips(sentinel2, storage.ls("S2/"), "s2", debug=debug)
-    collection_add_sentinel_chips(sentinel2, storage.ls("S2_NoQC/"), "s2", debug=debug)
-    collection_update_extents(sentinel2)
-    catalog.add_child(sentinel2)
 
-    # Build S1 Weak Labels Collection
+    def sentinel2_add_items(collection, objects):
+        collection_add_sentinel_chips(collection, objects, "s2")
+
+    # S1 Weak Labels Collection
     s1weak_labels = Collection(
         "S1Flood_NoQC",
         "Chips of water/nowater labels derived from standard OTSU thresholding of Sentinel-1 VH band overlapping weakly-labeled data.",  # noqa: E501
         extent=Extent(SpatialExtent([None, None, None, None]), None),
         stac_extensions=[Extensions.LABEL],
     )
-    label_collection_add_items(
-        s1weak_labels,
-        catalog,
-        storage.ls("S1Flood_NoQC/"),
-        sentinel1_links_func,
-        "0: Not Water. 1: Water.",
-        LabelType.RASTER,
-        label_classes=[LabelClasses([0, 1])],
-        label_tasks=["classification"],
-        debug=debug,
-    )
-    collection_update_extents(s1weak_labels)
-    catalog.add_child(s1weak_labels)
 
-    # Build S2 Weak Labels Collection
+    def s1weak_labels_add_items(collection, objects):
+        label_collection_add_items(
+            collection,
+            catalog,
+            objects,
+            sentinel1_links_func,
+            "0: Not Water. 1: Water.",
+            LabelType.RASTER,
+            label_classes=[LabelClasses([0, 1])],
+            label_tasks=["classification"],
+        )
+
+    # S2 Weak Labels Collection
     s2weak_labels = Collection(
         "NoQC",
         "Weakly-labeled chips derived from traditional Sentinel-2 Classification",  # noqa: E501
         extent=Extent(SpatialExtent([None, None, None, None]), None),
         stac_extensions=[Extensions.LABEL],
     )
-    label_collection_add_items(
-        s2weak_labels,
-        catalog,
-        storage.ls("NoQC/"),
-        sentinel2_links_func,
-        "-1: No Data / Not Valid. 0: Not Water. 1: Water.",  # noqa: E501
-        LabelType.RASTER,
-        label_classes=[LabelClasses([-1, 0, 1])],
-        label_tasks=["classification"],
-        debug=debug,
-    )
-    collection_update_extents(s2weak_labels)
-    catalog.add_child(s2weak_labels)
 
-    # Build Hand Labels Collection
+    def s2weak_labels_add_items(collection, objects):
+        label_collection_add_items(
+            collection,
+            catalog,
+            objects,
+            sentinel2_links_func,
+            "-1: No Data / Not Valid. 0: Not Water. 1: Water.",  # noqa: E501
+            LabelType.RASTER,
+            label_classes=[LabelClasses([-1, 0, 1])],
+            label_tasks=["classification"],
+        )
+
+    # Hand Labels Collection
     hand_labels = Collection(
         "QC_v2",
         "446 hand labeled chips of surface water from selected flood events",
         extent=Extent(SpatialExtent([None, None, None, None]), None),
         stac_extensions=[Extensions.LABEL],
     )
-    label_collection_add_items(
-        hand_labels,
-        catalog,
-        storage.ls("QC_v2/"),
-        sentinel1_sentinel2_links_func,
-        "Hand labeled chips containing ground truth. -1: No Data / Not Valid. 0: Not Water. 1: Water.",  # noqa: E501
-        LabelType.RASTER,
-        label_classes=[LabelClasses([-1, 0, 1])],
-        label_tasks=["classification"],
-        debug=debug,
-    )
-    collection_update_extents(hand_labels)
-    catalog.add_child(hand_labels)
 
-    # Build Permanent Labels collection
+    def hand_labels_add_items(collection, objects):
+        label_collection_add_items(
+            collection,
+            catalog,
+            objects,
+            sentinel1_sentinel2_links_func,
+            "Hand labeled chips containing ground truth. -1: No Data / Not Valid. 0: Not Water. 1: Water.",  # noqa: E501
+            LabelType.RASTER,
+            label_classes=[LabelClasses([-1, 0, 1])],
+            label_tasks=["classification"],
+        )
+
+    # Permanent Labels collection
     permanent_labels = Collection(
         "Perm",
         "Permanent water chips generated from the 'transition' layer of the JRC (European Commission Joint Research Centre) dataset",  # noqa: E501
         extent=Extent(SpatialExtent([None, None, None, None]), None),
         stac_extensions=[Extensions.LABEL],
     )
-    label_collection_add_items(
-        permanent_labels,
-        catalog,
-        storage.ls("Perm/"),
-        lambda *_: [],  # No easy way to map JRC source files to the label chips...
-        "0: Not Water. 1: Water.",
-        LabelType.RASTER,
-        label_classes=[LabelClasses([0, 1])],
-        label_tasks=["classification"],
-        debug=debug,
-    )
-    collection_update_extents(permanent_labels)
-    catalog.add_child(permanent_labels)
 
-    # Build Otsu algorithm Labels collection
+    def permanent_labels_add_items(collection, objects):
+        label_collection_add_items(
+            collection,
+            catalog,
+            objects,
+            lambda *_: [],  # No easy way to map JRC source files to the label chips...
+            "0: Not Water. 1: Water.",
+            LabelType.RASTER,
+            label_classes=[LabelClasses([0, 1])],
+            label_tasks=["classification"],
+        )
+
+    # Otsu algorithm Labels collection
     otsu_labels = Collection(
         "S1Flood",
         "Chips of water/nowater derived from standard OTSU thresholding of Sentinel-1 VH band overlapping labeled data",  # noqa: E501
         extent=Extent(SpatialExtent([None, None, None, None]), None),
         stac_extensions=[Extensions.LABEL],
     )
-    label_collection_add_items(
-        otsu_labels,
-        catalog,
-        storage.ls("S1Flood/"),
-        sentinel1_links_func,
-        "0: Not Water. 1: Water.",
-        LabelType.RASTER,
-        label_classes=[LabelClasses([0, 1])],
-        label_tasks=["classification"],
-        debug=debug,
-    )
-    collection_update_extents(otsu_labels)
-    catalog.add_child(otsu_labels)
 
-    # Save Complete Catalog
-    root_path = "./catalog"
-    catalog.normalize_and_save(root_path, catalog_type=CatalogType.SELF_CONTAINED)
+    def otsu_labels_add_items(collection, objects):
+        label_collection_add_items(
+            collection,
+            catalog,
+            objects,
+            sentinel1_links_func,
+            "0: Not Water. 1: Water.",
+            LabelType.RASTER,
+            label_classes=[LabelClasses([0, 1])],
+            label_tasks=["classification"],
+        )
+
+    # (collection, add_items, sentinel_version, source_sensors)
+    collection_builds = [
+        (sentinel1, sentinel1_add_items, "s1", []),
+        (sentinel2, sentinel2_add_items, "s2", []),
+        (s1weak_labels, s1weak_labels_add_items, None, ["S1"]),
+        (s2weak_labels, s2weak_labels_add_items, None, ["S2"]),
+        (hand_labels, hand_labels_add_items, None, ["S1", "S2"]),
+        (permanent_labels, permanent_labels_add_items, None, []),
+        (otsu_labels, otsu_labels_add_items, None, ["S1"]),
+    ]
+    for collection, *_ in collection_builds:
+        catalog.add_child(collection)
+    # Collections are empty, so this only sets the hrefs of the catalog and its collections
+    catalog.normalize_hrefs(root_path)
+    if args.valid_csv:
+        add_split_catalogs(
+            catalog, ChipSplits.from_csvs(args.valid_csv, args.test_csvs), root_path
+        )
+
+    # Pipeline: every prefix is listed concurrently into a single stream. Each listed chip
+    # starts a bbox read on header_executor and is queued for its collection, which is built
+    # on build_executor as soon as its chips arrive.
+    prefix_queues = {prefix: queue.Queue() for prefix in CHIP_PREFIXES}
+    with ThreadPoolExecutor(
+        max_workers=args.workers
+    ) as header_executor, ThreadPoolExecutor(
+        max_workers=len(collection_builds)
+    ) as build_executor:
+        build_futures = []
+        for (
+            collection,
+            add_items,
+            sentinel_version,
+            source_sensors,
+        ) in collection_builds:
+            objects = chain.from_iterable(
+                [
+                    queued_objects(prefix_queues[prefix])
+                    for prefix, collection_id in CHIP_PREFIXES.items()
+                    if collection_id == collection.id
+                ]
+            )
+            build_futures.append(
+                build_executor.submit(
+                    build_collection,
+                    catalog,
+                    collection,
+                    objects,
+                    manifest,
+                    root_path,
+                    add_items,
+                    sentinel_version=sentinel_version,
+                    source_sensors=source_sensors,
+                    workers=args.workers,
+                    compact=args.compact,
+                )
+            )
+
+        open_prefixes = set(CHIP_PREFIXES)
+        try:
+            for prefix, obj in stream_chip_objects(storage, CHIP_PREFIXES, debug):
+                if obj is None:
+                    open_prefixes.remove(prefix)
+                elif (
+                    obj.uri.endswith(".tif")
+                    and obj.size > 0
+                    and not manifest.is_current(CHIP_PREFIXES[prefix], obj)
+                ):
+                    request_chip_bbox(obj, header_executor)
+                prefix_queues[prefix].put(obj)
+        finally:
+            # Don't leave builds waiting on prefixes that failed to list, and don't let them save
+            # a collection or manifest entries from a partial listing
+            for prefix in open_prefixes:
+                prefix_queues[prefix].put(
+                    ChipListingError("Listing {} did not complete".format(prefix))
+                )
+
+        for future in build_futures:
+            future.result()
+
     print("Saved STAC Catalog {} to {}...".format(catalog.id, root_path))
+    print(
+        "Added {} Items, read {} chip headers".format(
+            BUILD_STATS["items"], BUILD_STATS["header_reads"]
+        )
+    )
+
+    if args.snapshot:
+        write_snapshot(catalog_items(catalog), args.snapshot)
+        print("Saved Item snapshot to {}...".format(args.snapshot))
 
 
 if __name__ == "__main__":
@@ -0,0 +1,51 @@
+import json
+import os
+
+
+class BuildManifest:
+    """ Record of the objects that have been turned into Items in each collection of a catalog
+
+    Maps collection id -> object uri -> (etag, size, item id). Saved alongside each collection
+    so that an interrupted or repeated build only needs to add Items for objects that are new
+    or have changed since the last save.
+
+    """
+
+    def __init__(self, path, collections=None):
+        self.path = path
+        self.collections = collections if collections is not None else {}
+
+    @classmethod
+    def load(cls, path):
+        """ Load manifest from path, or return an empty manifest if there isn't one """
+        if not os.path.isfile(path):
+            return cls(path)
+        with open(path) as f:
+            return cls(path, json.load(f))
+
+    def is_current(self, collection_id, obj):
+        """ True if StorageObject obj is unchanged since its Item was added to collection_id """
+        entry = self.collections.get(collection_id, {}).get(obj.uri, None)
+        return entry is not None and entry[0] == obj.etag and entry[1] == obj.size
+
+    def replace(self, collection_id, entries):
+        """ Set the Items of collection_id to entries, a list of (StorageObject, item id)
+
+        Returns set of the ids of Items that were in collection_id but are not in entries.
+
+        """
+        previous = self.collections.get(collection_id, {})
+        self.collections[collection_id] = {
+            obj.uri: [obj.etag, obj.size, item_id] for obj, item_id in entries
+        }
+        return {entry[2] for entry in previous.values()} - {
+            item_id for _, item_id in entries
+        }
+
+    def save(self):
+        """ Atomically write manifest to path """
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = "{}.tmp".format(self.path)
+        with open(tmp_path, "w") as f:
+            json.dump(self.collections, f)
+        os.replace(tmp_path, self.path)
@@ -0,0 +1,86 @@
+from collections import namedtuple
+import json
+import os
+import sqlite3
+import threading
+
+# Metadata read from a chip GeoTIFF header. datetime is the raw TIFFTAG_DATETIME, if any.
+ChipHeader = namedtuple(
+    "ChipHeader", ["bounds", "crs", "dtype", "width", "height", "datetime"]
+)
+
+
+class ChipHeaderCache:
+    """ Persistent SQLite cache of ChipHeaders keyed by object uri
+
+    Each row also stores the ETag and size of the object it was read from. Lookups only hit
+    when both still match the object as currently listed, so reruns after an upstream change
+    only need to re-read headers for the objects that changed.
+
+    The database is opened on first use so the cache can be constructed at import time, and
+    is shared between threads behind a lock.
+
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._connection = None
+        self._lock = threading.RLock()
+
+    @property
+    def connection(self):
+        if self._connection is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self._connection = sqlite3.connect(self.path, check_same_thread=False)
+            self._connection.execute(
+                """
+                CREATE TABLE IF NOT EXISTS chip_headers (
+                    uri TEXT PRIMARY KEY,
+                    etag TEXT,
+                    size INTEGER,
+                    bounds TEXT NOT NULL,
+                    crs TEXT,
+                    dtype TEXT,
+                    width INTEGER,
+                    height INTEGER,
+                    datetime TEXT
+                )
+                """
+            )
+        return self._connection
+
+    def get(self, obj):
+        """ Return ChipHeader for StorageObject obj or None if missing or stale """
+        with self._lock:
+            row = self.connection.execute(
+                "SELECT bounds, crs, dtype, width, height, datetime FROM chip_headers "
+                "WHERE uri = ? AND etag IS ? AND size IS ?",
+                (obj.uri, obj.etag, obj.size),
+            ).fetchone()
+        if row is None:
+            return None
+        bounds, *rest = row
+        return ChipHeader(json.loads(bounds), *rest)
+
+    def put(self, obj, header):
+        """ Store ChipHeader read from StorageObject obj. Call commit() to persist. """
+        with self._lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO chip_headers VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    obj.uri,
+                    obj.etag,
+                    obj.size,
+                    json.dumps(list(header.bounds)),
+                    header.crs,
+                    header.dtype,
+                    header.width,
+                    header.height,
+                    header.datetime,
+                ),
+            )
+
+    def commit(self):
+        with self._lock:
+            if self._connection is not None:
+                self._connection.commit()
@@ -0,0 +1,49 @@
+import csv
+import os
+
+# Splits that get their own root catalog, in addition to the catalog of all chips
+SPLITS = ["training", "validation"]
+
+
+def load_split_csv(path):
+    """ Returns set of "country_eventid" chip ids for the chips listed in a sen1floods11 split CSV
+
+    The first column of each row is a chip path, e.g. S1/Ghana_103272_S1.tif
+
+    """
+    with open(path) as f:
+        return {
+            "_".join(os.path.basename(row[0]).split("_")[0:-1])
+            for row in csv.reader(f)
+            if row
+        }
+
+
+class ChipSplits:
+    """ Assigns chips to the training or validation split of the sen1floods11 experiments
+
+    Follows the splits used by ../sen1floods11-mldata: chips in the validation CSV are
+    validation chips, chips in any test CSV are in neither split and all other chips are
+    training chips. Bolivia is held out entirely.
+
+    """
+
+    def __init__(self, valid_chips, test_chips):
+        self.valid_chips = valid_chips
+        self.test_chips = test_chips
+
+    @classmethod
+    def from_csvs(cls, valid_csv, test_csvs=()):
+        test_chips = set()
+        for test_csv in test_csvs:
+            test_chips.update(load_split_csv(test_csv))
+        return cls(load_split_csv(valid_csv), test_chips)
+
+    def split(self, country, event_id):
+        """ Returns the split of the chip for country + event_id, or None if it is in neither """
+        chip_id = "{}_{}".format(country, event_id)
+        if country == "Bolivia" or chip_id in self.test_chips:
+            return None
+        if chip_id in self.valid_chips:
+            return "validation"
+        return "training"
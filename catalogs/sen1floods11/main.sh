@@ -6,7 +6,15 @@ aws s3 ls s3://sen1floods11-data
 STATUS=$?
 
 if [ $STATUS -eq 0 ]; then
-  python build_catalog.py
+  mkdir -p ./data
+  for CSV in flood_valid_data.csv flood_test_data.csv flood_bolivia_data.csv; do
+    if ! test -f ./data/$CSV; then
+      aws s3 cp s3://sen1floods11-data/$CSV ./data/$CSV
+    fi
+  done
+  python build_catalog.py \
+    --valid-csv ./data/flood_valid_data.csv \
+    --test-csvs ./data/flood_test_data.csv ./data/flood_bolivia_data.csv
 else
   echo "Ensure AWS_PROFILE is set to a profile that is able to read s3://sen1floods11-data"
 fi
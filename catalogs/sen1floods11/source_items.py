@@ -0,0 +1,152 @@
+from collections import namedtuple
+import json
+import os
+import threading
+
+# A sentinel chip Item that LabelItems link to as a source. href is relative to the directory
+# of the root catalog.
+SourceItem = namedtuple("SourceItem", ["id", "href"])
+
+
+class SourceSensorError(Exception):
+    """ The collection of a sensor failed to build, so its Items can't be linked """
+
+    pass
+
+
+class SourceItemRegistry:
+    """ Thread safe map of (sensor, country, event_id) -> SourceItem
+
+    Records the id and final href of each sentinel chip Item rather than the Item itself, so
+    LabelItems can be linked to their sources without holding the sentinel collections in
+    memory. The registry can be pickled to worker processes, or saved and loaded to build label
+    collections in a later invocation.
+
+    LabelItems are built while the sentinel collections they link to are still being built, so
+    get() waits until the requested entry is added or its sensor is marked complete. If the
+    sensor is marked failed instead, get() and wait_complete() raise SourceSensorError so
+    nothing is saved with links to a partly built collection.
+
+    Entries in stale were loaded from a previous build and have not been added again by this
+    one. They are returned by get() straight away, and removed by prune() once every Item of
+    their sensor has been added.
+
+    """
+
+    def __init__(self, path, items=None, complete=(), stale=()):
+        self.path = path
+        self._items = items if items is not None else {}
+        self._complete = set(complete)
+        self._stale = set(stale)
+        self._failed = set()
+        self._condition = threading.Condition()
+
+    @classmethod
+    def load(cls, path):
+        """ Load registry from path, or return an empty registry if there isn't one
+
+        Every loaded entry is stale and no sensor is complete, so the build that loads the
+        registry can link LabelItems to unchanged chips before their sensor is listed again, and
+        still waits for the chips that are new.
+
+        """
+        if not os.path.isfile(path):
+            return cls(path)
+        with open(path) as f:
+            data = json.load(f)
+        items = {
+            (sensor, country, event_id): SourceItem(item_id, href)
+            for sensor, country, event_id, item_id, href in data["items"]
+        }
+        return cls(path, items, stale=items.keys())
+
+    def __getstate__(self):
+        with self._condition:
+            return (
+                self.path,
+                dict(self._items),
+                set(self._complete),
+                set(self._stale),
+            )
+
+    def __setstate__(self, state):
+        self.__init__(*state)
+
+    def add(self, sensor, country, event_id, item_id, href):
+        with self._condition:
+            self._items[(sensor, country, event_id)] = SourceItem(item_id, href)
+            self._stale.discard((sensor, country, event_id))
+            self._condition.notify_all()
+
+    def prune(self, sensor):
+        """ Remove the stale entries of sensor, once every Item of sensor has been added """
+        with self._condition:
+            for key in [key for key in self._stale if key[0] == sensor]:
+                del self._items[key]
+                self._stale.remove(key)
+
+    def complete(self, sensor):
+        """ Mark that no more Items will be added for sensor """
+        with self._condition:
+            self.prune(sensor)
+            self._complete.add(sensor)
+            self._condition.notify_all()
+
+    def fail(self, sensor):
+        """ Mark that sensor failed to build, so no more Items will be added for it """
+        with self._condition:
+            self._failed.add(sensor)
+            self._condition.notify_all()
+
+    def _raise_failed(self, sensors):
+        failed = self._failed.intersection(sensors)
+        if failed:
+            raise SourceSensorError(
+                "Source collection {} failed to build".format(", ".join(sorted(failed)))
+            )
+
+    def wait_complete(self, sensors):
+        """ Wait until every sensor in sensors is complete, raising if one of them failed """
+        with self._condition:
+            self._condition.wait_for(
+                lambda: self._complete.issuperset(sensors)
+                or self._failed.intersection(sensors)
+            )
+            self._raise_failed(sensors)
+
+    def get(self, sensor, country, event_id):
+        """ Returns SourceItem for the chip, or None if sensor completes without one """
+        key = (sensor, country, event_id)
+        with self._condition:
+            self._condition.wait_for(
+                lambda: key in self._items
+                or sensor in self._complete
+                or sensor in self._failed
+            )
+            self._raise_failed([sensor])
+            return self._items.get(key, None)
+
+    def hrefs(self):
+        """ Returns set of the href of every SourceItem """
+        with self._condition:
+            return {source.href for source in self._items.values()}
+
+    def save(self, complete=()):
+        """ Atomically write registry to path
+
+        Sensors in complete are saved as complete, in addition to those already marked complete.
+
+        """
+        with self._condition:
+            data = {
+                "complete": sorted(self._complete.union(complete)),
+                "items": [
+                    [*key, source.id, source.href]
+                    for key, source in sorted(self._items.items())
+                ],
+            }
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = "{}.tmp".format(self.path)
+        with open(tmp_path, "w") as f:
+            json.dump(data, f)
+        os.replace(tmp_path, self.path)
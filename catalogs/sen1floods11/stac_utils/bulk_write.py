@@ -0,0 +1,134 @@
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+import json
+import os
+from urllib.parse import urlparse
+
+from pystac import STAC_IO, CatalogType, Item
+
+
+def stac_object_json(stac_object, include_self_link=False, compact=False):
+    """ Serialize a pystac Catalog, Collection or Item to a JSON string
+
+    With compact=False the output matches pystac's own writer. compact=True drops indentation
+    and whitespace between separators, which roughly halves the size of an Item.
+
+    """
+    stac_dict = stac_object.to_dict(include_self_link=include_self_link)
+    if compact:
+        return json.dumps(stac_dict, separators=(",", ":"))
+    return json.dumps(stac_dict, indent=4)
+
+
+def save_object_json(stac_object, include_self_link=False, compact=False):
+    """ Write stac_object to its self href with STAC_IO """
+    href = stac_object.get_self_href()
+    if urlparse(href).scheme == "":
+        # pystac's default writer races to create directories when called from many threads
+        os.makedirs(os.path.dirname(href), exist_ok=True)
+    STAC_IO.write_text(
+        href,
+        stac_object_json(
+            stac_object, include_self_link=include_self_link, compact=compact
+        ),
+    )
+
+
+def save_objects(stac_objects, include_self_link=False, workers=16, compact=False):
+    """ Write each STAC object in stac_objects to its self href on a pool of workers threads
+
+    Objects must already have their self href set and their links made relative or absolute.
+
+    """
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = [
+            executor.submit(
+                save_object_json,
+                stac_object,
+                include_self_link=include_self_link,
+                compact=compact,
+            )
+            for stac_object in stac_objects
+        ]
+        for future in futures:
+            future.result()
+
+
+@contextmanager
+def self_links_first(catalogs):
+    """ Temporarily move the self link of each catalog to the front of its links
+
+    pystac finds a self href by scanning links in order, and set_self_href appends the self
+    link after every item link. Serializing an Item looks up the self href of its root, parent
+    and collection, and serializing a collection looks up its own self href for every link, so
+    writing a collection and its Items is otherwise quadratic in their number. Catalogs saved
+    with a self link list it first.
+
+    """
+    original_links = [(catalog, catalog.links) for catalog in catalogs]
+    for catalog, links in original_links:
+        catalog.links = sorted(links, key=lambda link: link.rel != "self")
+    try:
+        yield
+    finally:
+        for catalog, links in original_links:
+            catalog.links = links
+
+
+def catalog_objects(catalog, catalog_type, is_root=True):
+    """ Yield (stac_object, include_self_link) for everything pystac's Catalog.save writes """
+    include_self_link = catalog_type in [
+        CatalogType.ABSOLUTE_PUBLISHED,
+        CatalogType.RELATIVE_PUBLISHED,
+    ] and (is_root or catalog_type == CatalogType.ABSOLUTE_PUBLISHED)
+    items_include_self_link = catalog_type == CatalogType.ABSOLUTE_PUBLISHED
+
+    for link in catalog.get_child_links():
+        if link.is_resolved():
+            yield from catalog_objects(link.target, catalog_type, is_root=False)
+    for link in catalog.get_item_links():
+        if link.is_resolved():
+            yield link.target, items_include_self_link
+    yield catalog, include_self_link
+
+
+def normalize_and_save(
+    catalog,
+    root_href,
+    catalog_type=CatalogType.SELF_CONTAINED,
+    workers=16,
+    compact=False,
+):
+    """ Drop in replacement for catalog.normalize_and_save that writes Items concurrently
+
+    pystac normalizes hrefs and then serializes and writes every object in turn, which is slow
+    for catalogs of many small Items, especially on network filesystems. This normalizes once,
+    then serializes and writes Items on a thread pool, followed by the catalogs.
+
+    """
+    catalog.normalize_hrefs(root_href)
+    if catalog_type == CatalogType.ABSOLUTE_PUBLISHED:
+        catalog.make_all_links_absolute()
+    else:
+        catalog.make_all_links_relative()
+
+    catalogs = []
+    items = {True: [], False: []}
+    for stac_object, include_self_link in catalog_objects(catalog, catalog_type):
+        if isinstance(stac_object, Item):
+            items[include_self_link].append(stac_object)
+        else:
+            catalogs.append((stac_object, include_self_link))
+
+    with self_links_first([stac_object for stac_object, _ in catalogs]):
+        for include_self_link, stac_objects in items.items():
+            save_objects(
+                stac_objects,
+                include_self_link=include_self_link,
+                workers=workers,
+                compact=compact,
+            )
+        for stac_object, include_self_link in catalogs:
+            save_object_json(
+                stac_object, include_self_link=include_self_link, compact=compact
+            )
@@ -0,0 +1,220 @@
+from collections import namedtuple
+import struct
+
+import rasterio
+
+# Georeferencing and layout of a GeoTIFF, as rasterio reports it. bounds is
+# [left, bottom, right, top] and datetime is the raw TIFFTAG_DATETIME, if any.
+GeoTiffHeader = namedtuple(
+    "GeoTiffHeader", ["bounds", "crs", "dtype", "width", "height", "datetime"]
+)
+
+# Bytes read by read_geotiff_header. GDAL writes the IFD and GeoTIFF tags of a COG, and usually
+# of a plain GeoTIFF, ahead of the image data, so they fit in the first few KB.
+HEADER_PROBE_BYTES = 16384
+
+# TIFF field type -> (struct format, size in bytes) for the field types we need to decode
+TIFF_FIELD_TYPES = {
+    1: ("B", 1),  # BYTE
+    2: ("s", 1),  # ASCII
+    3: ("H", 2),  # SHORT
+    4: ("I", 4),  # LONG
+    11: ("f", 4),  # FLOAT
+    12: ("d", 8),  # DOUBLE
+    16: ("Q", 8),  # LONG8
+}
+
+IMAGE_WIDTH = 256
+IMAGE_LENGTH = 257
+BITS_PER_SAMPLE = 258
+DATE_TIME = 306
+SAMPLE_FORMAT = 339
+MODEL_PIXEL_SCALE = 33550
+MODEL_TIEPOINT = 33922
+MODEL_TRANSFORMATION = 34264
+GEO_KEY_DIRECTORY = 34735
+HEADER_TAGS = {
+    IMAGE_WIDTH,
+    IMAGE_LENGTH,
+    BITS_PER_SAMPLE,
+    DATE_TIME,
+    SAMPLE_FORMAT,
+    MODEL_PIXEL_SCALE,
+    MODEL_TIEPOINT,
+    MODEL_TRANSFORMATION,
+    GEO_KEY_DIRECTORY,
+}
+
+GT_MODEL_TYPE = 1024
+GT_RASTER_TYPE = 1025
+GEOGRAPHIC_TYPE = 2048
+PROJECTED_CS_TYPE = 3072
+
+# (SampleFormat, BitsPerSample) -> numpy dtype name
+SAMPLE_DTYPES = {
+    (1, 8): "uint8",
+    (2, 8): "int8",
+    (1, 16): "uint16",
+    (2, 16): "int16",
+    (1, 32): "uint32",
+    (2, 32): "int32",
+    (3, 32): "float32",
+    (3, 64): "float64",
+}
+
+
+class GeoTiffHeaderError(Exception):
+    """ The header can't be parsed from the bytes read, or needs GDAL to interpret """
+
+    pass
+
+
+def unpack_from(fmt, data, offset):
+    try:
+        return struct.unpack_from(fmt, data, offset)
+    except struct.error:
+        raise GeoTiffHeaderError(
+            "TIFF header extends beyond the {} bytes read".format(len(data))
+        )
+
+
+def read_ifd_tags(data):
+    """ Returns dict of tag -> tuple of values for the HEADER_TAGS in the first IFD of data """
+    if data[:2] == b"II":
+        order = "<"
+    elif data[:2] == b"MM":
+        order = ">"
+    else:
+        raise GeoTiffHeaderError("Not a TIFF")
+    (version,) = unpack_from(order + "H", data, 2)
+    if version == 42:
+        (ifd_offset,) = unpack_from(order + "I", data, 4)
+        count_format, offset_format, entry_size = "H", "I", 12
+    elif version == 43:
+        (ifd_offset,) = unpack_from(order + "Q", data, 8)
+        count_format, offset_format, entry_size = "Q", "Q", 20
+    else:
+        raise GeoTiffHeaderError("Unknown TIFF version {}".format(version))
+
+    (num_entries,) = unpack_from(order + count_format, data, ifd_offset)
+    entries_offset = ifd_offset + struct.calcsize(count_format)
+    count_size = struct.calcsize(offset_format)
+    tags = {}
+    for i in range(num_entries):
+        entry_offset = entries_offset + i * entry_size
+        tag, field_type = unpack_from(order + "HH", data, entry_offset)
+        if tag not in HEADER_TAGS:
+            continue
+        if field_type not in TIFF_FIELD_TYPES:
+            raise GeoTiffHeaderError(
+                "Unsupported type {} for tag {}".format(field_type, tag)
+            )
+        (count,) = unpack_from(order + offset_format, data, entry_offset + 4)
+        value_format, value_size = TIFF_FIELD_TYPES[field_type]
+        value_offset = entry_offset + 4 + count_size
+        if count * value_size > count_size:
+            (value_offset,) = unpack_from(order + offset_format, data, value_offset)
+        if field_type == 2:
+            (value,) = unpack_from("{}s".format(count), data, value_offset)
+            tags[tag] = (value.decode("ascii", "replace").rstrip("\x00"),)
+        else:
+            tags[tag] = unpack_from(
+                "{}{}{}".format(order, count, value_format), data, value_offset
+            )
+    return tags
+
+
+def read_geo_keys(tags):
+    """ Returns dict of GeoKey -> SHORT value from the GeoKeyDirectory tag """
+    directory = tags.get(GEO_KEY_DIRECTORY, None)
+    if directory is None:
+        raise GeoTiffHeaderError("No GeoKeyDirectory")
+    geo_keys = {}
+    # A 4 SHORT header, then 4 SHORTs for each key
+    for key, location, _, value in zip(*[iter(directory[4:])] * 4):
+        # Other locations point at the double or ascii params, which we don't need
+        if location == 0:
+            geo_keys[key] = value
+    return geo_keys
+
+
+def parse_geotiff_header(data):
+    """ Returns GeoTiffHeader parsed from data, the first bytes of a GeoTIFF
+
+    Only north up GeoTIFFs with a single tiepoint, PixelIsArea raster space and an EPSG coded
+    CRS are parsed. Anything else, or a header that extends beyond data, raises
+    GeoTiffHeaderError so it can be read with GDAL instead.
+
+    """
+    tags = read_ifd_tags(data)
+    if MODEL_TRANSFORMATION in tags:
+        raise GeoTiffHeaderError("ModelTransformation is not supported")
+    if MODEL_PIXEL_SCALE not in tags or len(tags.get(MODEL_TIEPOINT, ())) != 6:
+        raise GeoTiffHeaderError("Not georeferenced by a single tiepoint and scale")
+
+    geo_keys = read_geo_keys(tags)
+    if geo_keys.get(GT_RASTER_TYPE, 1) != 1:
+        raise GeoTiffHeaderError("PixelIsPoint is not supported")
+    model_type = geo_keys.get(GT_MODEL_TYPE, None)
+    if model_type == 1:
+        epsg = geo_keys.get(PROJECTED_CS_TYPE, None)
+    elif model_type == 2:
+        epsg = geo_keys.get(GEOGRAPHIC_TYPE, None)
+    else:
+        epsg = None
+    # 32767 is a user defined CRS
+    if epsg is None or epsg == 32767:
+        raise GeoTiffHeaderError("CRS is not an EPSG code")
+
+    sample_format = tags.get(SAMPLE_FORMAT, (1,))[0]
+    bits_per_sample = tags.get(BITS_PER_SAMPLE, (1,))[0]
+    dtype = SAMPLE_DTYPES.get((sample_format, bits_per_sample), None)
+    if dtype is None:
+        raise GeoTiffHeaderError(
+            "Unsupported {} bit sample format {}".format(bits_per_sample, sample_format)
+        )
+
+    width = tags[IMAGE_WIDTH][0]
+    height = tags[IMAGE_LENGTH][0]
+    scale_x, scale_y, _ = tags[MODEL_PIXEL_SCALE]
+    i, j, _, x, y, _ = tags[MODEL_TIEPOINT]
+    # The same arithmetic as GDAL's geotransform, so bounds match rasterio's exactly
+    left = x - i * scale_x
+    top = y - j * -scale_y
+    return GeoTiffHeader(
+        [left, top + height * -scale_y, left + width * scale_x, top],
+        "EPSG:{}".format(epsg),
+        dtype,
+        width,
+        height,
+        tags.get(DATE_TIME, (None,))[0],
+    )
+
+
+def read_geotiff_header_rasterio(uri):
+    """ Read GeoTiffHeader of uri with rasterio """
+    # Don't let GDAL list the file's parent "directory" on open, we only want the header
+    with rasterio.Env(GDAL_DISABLE_READDIR_ON_OPEN="EMPTY_DIR"):
+        with rasterio.open(uri) as src:
+            return GeoTiffHeader(
+                list(src.bounds),
+                src.crs.to_string() if src.crs else None,
+                src.dtypes[0],
+                src.width,
+                src.height,
+                src.tags().get("TIFFTAG_DATETIME", None),
+            )
+
+
+def read_geotiff_header(uri, read_range, probe_bytes=HEADER_PROBE_BYTES):
+    """ Returns GeoTiffHeader of the GeoTIFF at uri from a single ranged read
+
+    read_range(start, length) returns bytes of uri. Only the first probe_bytes are read and
+    parsed, which avoids the requests GDAL makes to open a remote file. Falls back to reading
+    uri with rasterio if the header can't be parsed from them.
+
+    """
+    try:
+        return parse_geotiff_header(read_range(0, probe_bytes))
+    except GeoTiffHeaderError:
+        return read_geotiff_header_rasterio(uri)
@@ -0,0 +1,148 @@
+import json
+
+from pystac import STAC_IO
+from pystac.utils import datetime_to_str
+from shapely.geometry import shape
+
+# Columns of a snapshot. properties, assets and links are JSON encoded in GeoParquet snapshots
+# because their fields vary between Items.
+SNAPSHOT_COLUMNS = [
+    "id",
+    "collection",
+    "href",
+    "datetime",
+    "minx",
+    "miny",
+    "maxx",
+    "maxy",
+    "geometry",
+    "properties",
+    "assets",
+    "links",
+]
+JSON_COLUMNS = ["properties", "assets", "links"]
+
+
+def catalog_items(catalog):
+    """ Yield every Item below catalog by following its child and item links
+
+    Unlike catalog.get_all_items() this doesn't resolve links through the root catalog's cache,
+    which is keyed by id and so conflates Items in different collections that share an id.
+
+    """
+    for link in catalog.links:
+        if link.rel not in ["child", "item"]:
+            continue
+        if not link.is_resolved():
+            link.resolve_stac_object()
+        if link.rel == "child":
+            yield from catalog_items(link.target)
+        else:
+            yield link.target
+
+
+def link_href(link, target_hrefs):
+    """ Absolute href of link, memoized by target in target_hrefs
+
+    Resolving the href of a parent or collection link scans every link of the collection, so
+    each target is only looked up once per snapshot.
+
+    """
+    if not link.is_resolved():
+        return link.get_absolute_href()
+    key = id(link.target)
+    if key not in target_hrefs:
+        target_hrefs[key] = link.get_absolute_href()
+    return target_hrefs[key]
+
+
+def item_record(item, target_hrefs=None):
+    """ Flatten a saved pystac.Item to a snapshot record
+
+    Items must have been saved, so that they and every STAC object they link to have a self
+    href. Asset and link hrefs are made absolute so the snapshot can be used on its own.
+
+    """
+    target_hrefs = target_hrefs if target_hrefs is not None else {}
+    minx, miny, maxx, maxy = item.bbox
+    return {
+        "id": item.id,
+        "collection": item.collection_id,
+        "href": item.get_self_href(),
+        "datetime": datetime_to_str(item.datetime) if item.datetime else None,
+        "minx": minx,
+        "miny": miny,
+        "maxx": maxx,
+        "maxy": maxy,
+        "geometry": item.geometry,
+        "properties": item.properties,
+        "assets": {
+            key: asset.get_absolute_href() for key, asset in item.assets.items()
+        },
+        "links": [
+            {"rel": link.rel, "href": link_href(link, target_hrefs)}
+            for link in item.links
+            if link.rel != "self"
+        ],
+    }
+
+
+def write_snapshot(items, uri):
+    """ Write every pystac.Item in items to a single file snapshot at uri
+
+    Snapshots hold the id, collection, href, datetime, bbox, geometry, properties, asset hrefs
+    and link targets of each Item, so a whole catalog can be loaded in one read and filtered
+    as a table rather than by walking the STAC tree an Item at a time.
+
+    uri ending in .parquet is written as GeoParquet, which requires geopandas and pyarrow. Any
+    other uri is written as newline delimited JSON with STAC_IO, one record per line.
+
+    """
+    target_hrefs = {}
+    records = (item_record(item, target_hrefs) for item in items)
+    if uri.endswith(".parquet"):
+        write_geoparquet(records, uri)
+    else:
+        STAC_IO.write_text(uri, "".join(json.dumps(r) + "\n" for r in records))
+
+
+def write_geoparquet(records, uri):
+    from geopandas import GeoDataFrame
+
+    rows = []
+    for record in records:
+        row = dict(record, geometry=shape(record["geometry"]))
+        for column in JSON_COLUMNS:
+            row[column] = json.dumps(record[column])
+        rows.append(row)
+    df = GeoDataFrame(
+        rows, columns=SNAPSHOT_COLUMNS, geometry="geometry", crs="EPSG:4326"
+    )
+    df.to_parquet(uri, index=False)
+
+
+def read_snapshot(uri):
+    """ Read a snapshot written by write_snapshot into a GeoDataFrame with one row per Item
+
+    Requires geopandas. properties, assets and links are decoded to dicts and lists for both
+    formats, and datetime is parsed to a pandas timestamp. Ids are only unique within a
+    collection, so rows are not indexed by id.
+
+    """
+    from geopandas import GeoDataFrame, read_parquet
+    from pandas import to_datetime
+
+    if uri.endswith(".parquet"):
+        df = read_parquet(uri)
+        for column in JSON_COLUMNS:
+            df[column] = df[column].map(json.loads)
+    else:
+        records = [
+            dict(record, geometry=shape(record["geometry"]))
+            for record in map(json.loads, STAC_IO.read_text(uri).splitlines())
+        ]
+        df = GeoDataFrame(
+            records, columns=SNAPSHOT_COLUMNS, geometry="geometry", crs="EPSG:4326"
+        )
+    df["datetime"] = to_datetime(df["datetime"], utc=True)
+    return df
@@ -0,0 +1,210 @@
+from abc import ABC, abstractmethod
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+import threading
+from urllib.parse import urlparse
+
+from stac_utils.geotiff_header import (
+    HEADER_PROBE_BYTES,
+    GeoTiffHeaderError,
+    parse_geotiff_header,
+    read_geotiff_header_rasterio,
+)
+from storage.cloud_storage import FileStorage, S3Storage, Storage
+
+
+class AsyncStorage(ABC):
+    """ asyncio version of Storage, for callers that fan out over many files at once
+
+    Any number of calls can be awaited together, e.g. with asyncio.gather, but at most
+    concurrency of them are in flight at a time. Blocking work runs on a thread pool of the
+    same size.
+
+    """
+
+    def __init__(self, concurrency=64):
+        self.concurrency = concurrency
+        self._executor = ThreadPoolExecutor(max_workers=concurrency)
+        self._semaphore = None
+        self._semaphore_loop = None
+
+    @property
+    def semaphore(self):
+        """ Semaphore bounding concurrent calls, created for the running event loop """
+        loop = asyncio.get_running_loop()
+        if self._semaphore_loop is not loop:
+            self._semaphore = asyncio.Semaphore(self.concurrency)
+            self._semaphore_loop = loop
+        return self._semaphore
+
+    async def run(self, fn, *args):
+        """ Await blocking fn(*args) on the thread pool, within the concurrency bound """
+        async with self.semaphore:
+            return await asyncio.get_running_loop().run_in_executor(
+                self._executor, partial(fn, *args)
+            )
+
+    @abstractmethod
+    async def ls(self, path):
+        """ Returns list of StorageObject for each file at path """
+        pass
+
+    @abstractmethod
+    async def stat(self, path):
+        """ Returns StorageObject for the file at path """
+        pass
+
+    @abstractmethod
+    async def read_bytes(self, uri):
+        """ Returns the contents of the file at uri, a StorageObject uri """
+        pass
+
+    @abstractmethod
+    async def read_range(self, uri, start, length):
+        """ Returns up to length bytes from start of the file at uri, a StorageObject uri """
+        pass
+
+    @abstractmethod
+    async def download(self, path, target_filename):
+        """ Place file at path at target_filename if target_filename does not exist """
+        pass
+
+    async def read_geotiff_header(self, uri):
+        """ Returns GeoTiffHeader of the GeoTIFF at uri, see Storage.read_geotiff_header """
+        try:
+            return parse_geotiff_header(
+                await self.read_range(uri, 0, HEADER_PROBE_BYTES)
+            )
+        except GeoTiffHeaderError:
+            return await self.run(read_geotiff_header_rasterio, uri)
+
+
+class AsyncFileStorage(AsyncStorage):
+    """ AsyncStorage of a local directory, with the same paths and uris as FileStorage """
+
+    def __init__(self, root_path="", concurrency=64):
+        super().__init__(concurrency)
+        self.storage = FileStorage(root_path)
+
+    async def ls(self, path):
+        return await self.run(lambda: list(self.storage.ls_objects(path)))
+
+    async def stat(self, path):
+        return await self.run(self.storage.stat, path)
+
+    async def read_bytes(self, uri):
+        def read():
+            with open(uri, "rb") as f:
+                return f.read()
+
+        return await self.run(read)
+
+    async def read_range(self, uri, start, length):
+        return await self.run(self.storage.read_range, uri, start, length)
+
+    async def download(self, path, target_filename):
+        return await self.run(self.storage.download, path, target_filename)
+
+
+class AsyncS3Storage(AsyncStorage):
+    """ AsyncStorage of an S3 bucket, with the same paths and uris as S3Storage
+
+    boto3 has no asyncio support, so each request is made on the thread pool with a client
+    shared by all of them.
+
+    """
+
+    def __init__(self, bucket_name, concurrency=64):
+        super().__init__(concurrency)
+        self.storage = S3Storage(bucket_name, workers=concurrency)
+
+    async def ls(self, prefix):
+        """ List prefix one "/" delimited level at a time, listing sub-prefixes concurrently """
+        objects = []
+        pending = {asyncio.ensure_future(self.run(self.storage.ls_level, prefix))}
+        while pending:
+            done, pending = await asyncio.wait(
+                pending, return_when=asyncio.FIRST_COMPLETED
+            )
+            for task in done:
+                level_objects, prefixes = task.result()
+                objects.extend(level_objects)
+                pending |= {
+                    asyncio.ensure_future(self.run(self.storage.ls_level, p))
+                    for p in prefixes
+                }
+        return objects
+
+    async def stat(self, path):
+        return await self.run(self.storage.stat, path)
+
+    async def read_bytes(self, uri):
+        def read():
+            response = self.storage.client.get_object(
+                Bucket=self.storage.bucket_name, Key=urlparse(uri).path.lstrip("/")
+            )
+            return response["Body"].read()
+
+        return await self.run(read)
+
+    async def read_range(self, uri, start, length):
+        return await self.run(self.storage.read_range, uri, start, length)
+
+    async def download(self, path, target_filename):
+        return await self.run(self.storage.download, path, target_filename)
+
+
+class SyncStorage(Storage):
+    """ Storage that drives an AsyncStorage, so synchronous builders can use it
+
+    Coroutines run on an event loop in a background thread, and each Storage method blocks
+    until its coroutine completes. Methods can be called from any number of threads at once.
+    Use map() to run a coroutine over many inputs concurrently from a single call.
+
+    """
+
+    def __init__(self, async_storage):
+        self.async_storage = async_storage
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self._thread.start()
+
+    def run(self, coroutine):
+        """ Run coroutine on the background event loop and return its result """
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+    def map(self, fn, iterable):
+        """ Returns [await fn(x) for x in iterable], awaiting every call concurrently """
+
+        async def gather():
+            return await asyncio.gather(*[fn(x) for x in iterable])
+
+        return self.run(gather())
+
+    def close(self):
+        """ Stop the background event loop """
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self._thread.join()
+
+    def ls(self, path):
+        for obj in self.ls_objects(path):
+            yield obj.uri
+
+    def ls_objects(self, path):
+        yield from self.run(self.async_storage.ls(path))
+
+    def stat(self, path):
+        return self.run(self.async_storage.stat(path))
+
+    def read_bytes(self, uri):
+        return self.run(self.async_storage.read_bytes(uri))
+
+    def read_range(self, uri, start, length):
+        return self.run(self.async_storage.read_range(uri, start, length))
+
+    def download(self, path, target_filename):
+        return self.run(self.async_storage.download(path, target_filename))
+
+    def read_geotiff_header(self, uri):
+        return self.run(self.async_storage.read_geotiff_header(uri))
@@ -1,9 +1,36 @@
 from abc import ABC, abstractmethod
-from os import listdir
-from os.path import exists, isfile, join
+from collections import namedtuple
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from hashlib import sha256
+from os import link, listdir, makedirs, replace, stat
+from os.path import abspath, dirname, exists, expanduser, isfile, join, samefile
 from shutil import copyfile
+import threading
+from urllib.parse import urlparse
+from uuid import uuid4
 
 import boto3
+from boto3.s3.transfer import TransferConfig
+from botocore.config import Config
+
+from stac_utils.geotiff_header import read_geotiff_header
+
+# A listed file along with the metadata needed to tell whether it has changed between listings
+StorageObject = namedtuple("StorageObject", ["uri", "size", "etag", "last_modified"])
+
+# Downloads made by download_many, stored by uri and ETag so they can be shared between runs
+DEFAULT_CACHE_DIR = join(expanduser("~"), ".cache", "noaa-flood-mapping", "objects")
+
+
+def download_cache_key(obj):
+    """ Returns the download cache filename of StorageObject obj
+
+    ETags alone don't identify a file. Local ETags are only mtime + size, and objects in
+    different buckets can share an ETag, so the key is a hash of the absolute uri and ETag.
+
+    """
+    uri = obj.uri if urlparse(obj.uri).scheme else abspath(obj.uri)
+    return sha256("{}\n{}".format(uri, obj.etag).encode("utf-8")).hexdigest()
 
 
 class Storage(ABC):
@@ -12,43 +39,224 @@ class Storage(ABC):
         """ Yield generator with a list of absolute or relative string paths """
         pass
 
+    @abstractmethod
+    def ls_objects(self, path):
+        """ Yield generator of StorageObject for each file at path """
+        pass
+
+    @abstractmethod
+    def stat(self, path):
+        """ Returns StorageObject for the file at path """
+        pass
+
     @abstractmethod
     def download(self, path, target_filename):
         """ Place file at path at target_filename if target_filename does not exist"""
-        blob = self.bucket.blob(path)
-        blob.download_to_filename(target_filename)
+        pass
+
+    @abstractmethod
+    def read_range(self, uri, start, length):
+        """ Returns up to length bytes from start of the file at uri, a StorageObject uri """
+        pass
+
+    def read_geotiff_header(self, uri):
+        """ Returns GeoTiffHeader of the GeoTIFF at uri, a StorageObject uri
+
+        Parses the header from a single ranged read of the start of the file, and only falls
+        back to opening uri with rasterio if the header is not within it.
+
+        """
+        return read_geotiff_header(
+            uri, lambda start, length: self.read_range(uri, start, length)
+        )
+
+    def download_many(self, paths, dest_dir, cache_dir=DEFAULT_CACHE_DIR, workers=16):
+        """ Download the files at paths to dest_dir on a pool of workers threads
+
+        Each file is placed at the same relative path under dest_dir, and the list of local
+        filenames is returned in the order of paths. Files are first downloaded to cache_dir,
+        named by download_cache_key, and then hard linked (or copied, across filesystems) into
+        dest_dir. A file whose uri and ETag are already in cache_dir, from this call or an
+        earlier one, is never downloaded again. Linked files share storage with the cache, so
+        treat them as read only.
+
+        """
+        key_locks = {}
+        key_locks_lock = threading.Lock()
+
+        def cached_download(path):
+            key = download_cache_key(self.stat(path))
+            cached_filename = join(cache_dir, key)
+            with key_locks_lock:
+                key_lock = key_locks.setdefault(key, threading.Lock())
+            with key_lock:
+                if not exists(cached_filename):
+                    makedirs(cache_dir, exist_ok=True)
+                    tmp_filename = "{}.{}.tmp".format(cached_filename, uuid4().hex)
+                    self.download(path, tmp_filename)
+                    replace(tmp_filename, cached_filename)
+
+            target_filename = join(dest_dir, path)
+            if exists(target_filename) and samefile(target_filename, cached_filename):
+                return target_filename
+            makedirs(dirname(target_filename) or ".", exist_ok=True)
+            tmp_filename = "{}.{}.tmp".format(target_filename, uuid4().hex)
+            try:
+                link(cached_filename, tmp_filename)
+            except OSError:
+                copyfile(cached_filename, tmp_filename)
+            replace(tmp_filename, target_filename)
+            return target_filename
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return list(executor.map(cached_download, paths))
 
 
 class FileStorage(Storage):
+    def __init__(self, root_path=""):
+        """ Paths are relative to root_path, so a local directory can stand in for a bucket """
+        self.root_path = root_path
+
     def ls(self, path):
+        path = join(self.root_path, path)
         for f in listdir(path):
             if isfile(join(path, f)):
                 yield f
 
+    def file_object(self, filename):
+        """ Returns StorageObject for local file filename """
+        file_stat = stat(filename)
+        # Local files have no ETag, so mimic one from mtime + size like most web servers
+        etag = "{:x}-{:x}".format(file_stat.st_mtime_ns, file_stat.st_size)
+        return StorageObject(filename, file_stat.st_size, etag, file_stat.st_mtime)
+
+    def ls_objects(self, path):
+        path = join(self.root_path, path)
+        for f in listdir(path):
+            filename = join(path, f)
+            if isfile(filename):
+                yield self.file_object(filename)
+
+    def stat(self, path):
+        return self.file_object(join(self.root_path, path))
+
     def download(self, path, target_filename):
         if not exists(target_filename):
-            copyfile(path, target_filename)
+            copyfile(join(self.root_path, path), target_filename)
+
+    def read_range(self, uri, start, length):
+        with open(uri, "rb") as f:
+            f.seek(start)
+            return f.read(length)
 
 
 class S3Storage(Storage):
-    def __init__(self, bucket_name):
+    def __init__(self, bucket_name, workers=16, connections=None):
+        """ workers is the number of concurrent requests made by ls_objects and download
+
+        connections is the size of the client's connection pool, workers by default. Raise it
+        if other threads make requests through this storage at the same time.
+
+        """
         self.bucket_name = bucket_name
+        self.workers = workers
+        self.connections = connections if connections is not None else workers
+        self._client = None
+        self._client_lock = threading.Lock()
+        self._executor = None
+        self._executor_lock = threading.Lock()
+
+    @property
+    def client(self):
+        """ boto3 S3 client shared by every request, created on first use
+
+        Clients are thread safe, and sharing one reuses its connection pool rather than
+        setting up a new client and connections for every call.
+
+        """
+        with self._client_lock:
+            if self._client is None:
+                self._client = boto3.session.Session().client(
+                    "s3", config=Config(max_pool_connections=self.connections)
+                )
+            return self._client
+
+    @property
+    def executor(self):
+        """ Pool of workers threads shared by every ls_objects call, created on first use
+
+        Listing several prefixes at once makes at most workers requests in total, rather than
+        workers requests for each prefix.
+
+        """
+        with self._executor_lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.workers)
+            return self._executor
 
     def ls(self, prefix):
-        client = boto3.client("s3")
-        extra_args = {}
-        while True:
-            response = client.list_objects_v2(
-                Bucket=self.bucket_name, Prefix=prefix, **extra_args
-            )
-            for obj in response["Contents"]:
-                yield "s3://{}/{}".format(self.bucket_name, obj["Key"])
-            if not response["IsTruncated"]:
-                break
-            extra_args["ContinuationToken"] = response["NextContinuationToken"]
+        for obj in self.ls_objects(prefix):
+            yield obj.uri
+
+    def ls_level(self, prefix):
+        """ Returns ([StorageObject], [sub-prefix]) for the keys directly under prefix """
+        objects = []
+        prefixes = []
+        paginator = self.client.get_paginator("list_objects_v2")
+        for response in paginator.paginate(
+            Bucket=self.bucket_name, Prefix=prefix, Delimiter="/"
+        ):
+            for obj in response.get("Contents", []):
+                objects.append(
+                    StorageObject(
+                        "s3://{}/{}".format(self.bucket_name, obj["Key"]),
+                        obj["Size"],
+                        obj["ETag"].strip('"'),
+                        obj["LastModified"].timestamp(),
+                    )
+                )
+            prefixes.extend(p["Prefix"] for p in response.get("CommonPrefixes", []))
+        return objects, prefixes
+
+    def ls_objects(self, prefix):
+        """ Yield StorageObject for every key under prefix, in no particular order
+
+        Each "/" delimited level is listed with ls_level, and the sub-prefixes it finds are
+        listed concurrently on the shared executor, so listing a deep prefix or the whole
+        bucket is not one serial chain of paged requests.
+
+        """
+        futures = {self.executor.submit(self.ls_level, prefix)}
+        while futures:
+            done, futures = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                objects, prefixes = future.result()
+                futures |= {self.executor.submit(self.ls_level, p) for p in prefixes}
+                yield from objects
+
+    def stat(self, path):
+        response = self.client.head_object(Bucket=self.bucket_name, Key=path)
+        return StorageObject(
+            "s3://{}/{}".format(self.bucket_name, path),
+            response["ContentLength"],
+            response["ETag"].strip('"'),
+            response["LastModified"].timestamp(),
+        )
+
+    def read_range(self, uri, start, length):
+        response = self.client.get_object(
+            Bucket=self.bucket_name,
+            Key=urlparse(uri).path.lstrip("/"),
+            Range="bytes={}-{}".format(start, start + length - 1),
+        )
+        return response["Body"].read()
 
     def download(self, path, target_filename):
+        """ Download with concurrent ranged GETs for large files, see TransferConfig """
         if not exists(target_filename):
-            with open(target_filename, "wb") as f:
-                bucket = boto3.resource("s3").Bucket(self.bucket_name)
-                bucket.download_fileobj(path, f)
+            self.client.download_file(
+                self.bucket_name,
+                path,
+                target_filename,
+                Config=TransferConfig(max_concurrency=self.workers),
+            )
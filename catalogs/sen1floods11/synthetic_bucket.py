@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+
+import argparse
+import os
+
+import numpy as np
+import rasterio
+from rasterio.transform import from_origin
+
+from build_catalog import COUNTRY_ALIASES, load_chip_metadata
+
+# Suffix of the chip filenames in each folder, for chips that were hand labeled and for
+# chips that were only weakly labeled
+HAND_LABELED_FOLDERS = {
+    "S1/": "S1",
+    "S2/": "S2",
+    "QC_v2/": "QC",
+    "Perm/": "JRCPerm",
+    "S1Flood/": "S1Flood",
+}
+WEAKLY_LABELED_FOLDERS = {
+    "S1_NoQC/": "S1",
+    "S2_NoQC/": "S2",
+    "S1Flood_NoQC/": "S1Flood",
+    "NoQC/": "NoQC",
+}
+
+# The real dataset has 446 hand labeled chips out of 4831
+HAND_LABELED_FRACTION = 446 / 4831
+
+# Chips are 512px at 10m, so about 0.05 degrees
+CHIP_SIZE = 16
+CHIP_RESOLUTION = 0.05 / CHIP_SIZE
+
+
+def chip_countries():
+    """ Country names used in chip filenames, with the names the real bucket uses """
+    renames = {location: alias for alias, location in COUNTRY_ALIASES.items()}
+    return sorted(renames.get(c, c) for c in load_chip_metadata() if c not in renames)
+
+
+def write_chip(path, west, north, dtype):
+    with rasterio.open(
+        path,
+        "w",
+        driver="GTiff",
+        width=CHIP_SIZE,
+        height=CHIP_SIZE,
+        count=1,
+        dtype=dtype,
+        crs="EPSG:4326",
+        transform=from_origin(west, north, CHIP_RESOLUTION, CHIP_RESOLUTION),
+    ) as dst:
+        dst.write(np.zeros((1, CHIP_SIZE, CHIP_SIZE), dtype=dtype))
+
+
+def write_synthetic_bucket(root_path, num_chips, seed=0):
+    """ Write num_chips synthetic chip locations to root_path in the sen1floods11-data layout
+
+    Each chip location gets a tiny GeoTIFF in every folder that the real bucket has a chip in
+    for it: the sensor chips plus the hand labels for hand labeled chips, or the sensor chips
+    plus the weak labels otherwise. Chips are placed within their country's footprint in
+    chips_metadata.geojson.
+
+    Returns the number of files written.
+
+    """
+    random = np.random.RandomState(seed)
+    chip_metadata = load_chip_metadata()
+    countries = chip_countries()
+    for folder in list(HAND_LABELED_FOLDERS) + list(WEAKLY_LABELED_FOLDERS):
+        os.makedirs(os.path.join(root_path, folder), exist_ok=True)
+
+    num_files = 0
+    for i in range(num_chips):
+        country = countries[i % len(countries)]
+        event_id = 100000 + i
+        minx, miny, maxx, maxy = chip_metadata[country].footprint.bounds
+        west = random.uniform(minx, maxx)
+        north = random.uniform(miny, maxy)
+        if random.random_sample() < HAND_LABELED_FRACTION:
+            folders = HAND_LABELED_FOLDERS
+        else:
+            folders = WEAKLY_LABELED_FOLDERS
+        for folder, suffix in folders.items():
+            filename = "{}_{}_{}.tif".format(country, event_id, suffix)
+            dtype = "uint8" if suffix == "JRCPerm" else "int16"
+            write_chip(os.path.join(root_path, folder, filename), west, north, dtype)
+            num_files += 1
+    return num_files
+
+
+if __name__ == "__main__":
+    """ Write a synthetic sen1floods11-data bucket for build_catalog.py --local-bucket """
+    parser = argparse.ArgumentParser()
+    parser.add_argument("root_path", help="Directory to write the synthetic bucket to")
+    parser.add_argument("--chips", type=int, default=1000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    num_files = write_synthetic_bucket(args.root_path, args.chips, seed=args.seed)
+    print(
+        "Wrote {} chips in {} files to {}".format(args.chips, num_files, args.root_path)
+    )
@@ -4,6 +4,7 @@ import argparse
 import pystac
 
 from stac_utils.s3_io import register_s3_io
+from stac_utils.snapshot import catalog_items, write_snapshot
 
 
 def construct_label_item(ttv_item, chip_label_dir):
@@ -34,6 +35,11 @@ def main():
         default="s3://jrc-fimr-rasterized-labels/version2",
         type=str,
     )
+    parser.add_argument(
+        "--snapshot",
+        help="Also write every Item to this single file, as GeoParquet if it ends in .parquet "
+        "or else as newline delimited JSON",
+    )
     args = parser.parse_args()
 
     catalog = pystac.Catalog.from_file(args.mldata_catalog)
@@ -80,6 +86,9 @@ def main():
         catalog_type=pystac.CatalogType.SELF_CONTAINED,
     )
 
+    if args.snapshot:
+        write_snapshot(catalog_items(mldata_catalog), args.snapshot)
+
 
 if __name__ == "__main__":
     main()
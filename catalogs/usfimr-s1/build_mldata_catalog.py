@@ -27,11 +27,15 @@ def collect_items(sar_catalog, usfimr_collection):
 
     for flood_id in ["1", "2", "3", "15", "16"]:
         usfimr_item = usfimr_collection.get_item(flood_id)
-        usfimr_geojson_asset = usfimr_item.assets["geojson"]
+        # Labels are rasterized onto 10 m Sentinel-1 chips, so use the geojson simplified for
+        # 10 m pixels if the USFIMR catalog has one
+        usfimr_geojson_asset = usfimr_item.assets.get(
+            "geojson_10m", usfimr_item.assets["geojson"]
+        )
         usfimr_geojson_asset.set_owner(usfimr_item)
         usfimr_item_clone = usfimr_item.clone()
         # Reduce item assets to just the geojson as labels
-        usfimr_item_clone.assets = {"labels": usfimr_item.assets["geojson"]}
+        usfimr_item_clone.assets = {"labels": usfimr_geojson_asset}
         labels_collection.add_item(usfimr_item_clone)
 
         for sar_item in sar_catalog.get_child(flood_id).get_items():
@@ -11,7 +11,7 @@ from pystac import Collection
 
 from request_builders import (
     get_sentinel_hub_session,
-    search_sentinelhub_s1,
+    SentinelHubSearchClient,
     create_batch_request,
     analyze_batch_request,
     initiate_batch_request,
@@ -54,6 +54,18 @@ def make_parser():
         type=str,
         help="The bucket that should contain the output of the SentinelHub Batch Ingests",
     )
+    parser.add_argument(
+        "--search-workers",
+        default=8,
+        type=int,
+        help="Number of SentinelHub catalog searches to run at once",
+    )
+    parser.add_argument(
+        "--search-rate",
+        default=5,
+        type=float,
+        help="Maximum number of SentinelHub catalog searches to start per second",
+    )
     return parser
 
 
@@ -68,19 +80,23 @@ if __name__ == "__main__":
 
     # Read STAC from S3
     usfimr_collection = Collection.from_file("s3://usfimr-data/collection.json")
-    usfimr_floods = usfimr_collection.get_items()
+    usfimr_floods = list(usfimr_collection.get_items())
 
-    # Iterate through GLOFIMR flood events
-    flood_with_results = []
+    # Search for S1 scenes of every GLOFIMR flood event at once
+    search_client = SentinelHubSearchClient(
+        session, workers=args.search_workers, rate=args.search_rate
+    )
+    searches = []
     for flood in usfimr_floods:
-        # geom bounds
-        flood_bounds = flood.bbox
-
         # temporal bounds
         date_min, date_max = get_flood_temporal_bounds(flood)
-        search_results = search_sentinelhub_s1(
-            date_min, date_max, flood_bounds, session
-        )
+        # geom bounds
+        searches.append((date_min, date_max, flood.bbox))
+    flood_search_results = search_client.search_s1_many(searches)
+
+    # Iterate through GLOFIMR flood events
+    flood_with_results = []
+    for flood, search_results in zip(usfimr_floods, flood_search_results):
         search_results = search_results.json()
 
         result_count = search_results["context"]["returned"]
@@ -1,13 +1,17 @@
 #!/usr/bin/env python3
 
 import os
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
 from copy import deepcopy
 import json
 import argparse
 from datetime import date, time, datetime
+from math import floor
 
 import fiona
-from shapely.geometry import shape, mapping
+from shapely.geometry import MultiPolygon, shape, mapping
+from shapely.ops import clip_by_rect
 from pystac import (
     Asset,
     CatalogType,
@@ -18,9 +22,176 @@ from pystac import (
     TemporalExtent,
 )
 
+from stac_utils.snapshot import catalog_items, write_snapshot
+
+# Pixel sizes in meters of the imagery USFIMR labels are rasterized onto: Sentinel-1 and
+# Sentinel-2 at 10 m and Landsat at 30 m. A simplified GeoJSON is written for each of them.
+SIMPLIFIED_RESOLUTIONS = [10, 30]
+
+# Meters per degree of latitude. A degree of longitude is never longer, so a tolerance converted
+# with this is never more than the tolerance in meters in either direction.
+METERS_PER_DEGREE = 111320
+
+
+# Size in degrees of the tiles geometries are split into for the FlatGeobuf asset, about the
+# size of a 512 x 512 chip of 10 m pixels
+TILE_SIZE = 0.05
+
+FLATGEOBUF_SCHEMA = {
+    "geometry": "MultiPolygon",
+    "properties": {"column": "int", "row": "int"},
+}
+
+
+def simplify_tolerance(resolution):
+    """ Tolerance in degrees to simplify a geometry for rasterizing onto resolution meter pixels
+
+    Vertices move at most half a pixel, which rarely changes which pixels a polygon covers.
+
+    """
+    return resolution / 2 / METERS_PER_DEGREE
+
+
+def polygons(geom):
+    """ Returns list of the Polygons in geom, dropping any lines or points """
+    if geom.is_empty:
+        return []
+    if geom.geom_type == "Polygon":
+        return [geom]
+    if geom.geom_type in ["MultiPolygon", "GeometryCollection"]:
+        return [polygon for part in geom.geoms for polygon in polygons(part)]
+    return []
+
+
+def split_into_tiles(geom, tile_size=TILE_SIZE):
+    """ Yield (column, row, MultiPolygon) for each tile_size degree tile that geom covers
+
+    Tiles are on a global grid, column * tile_size to (column + 1) * tile_size degrees east and
+    likewise for rows, so the tiles of different floods line up. geom is clipped to each row and
+    then each row to its tiles with clip_by_rect, which is much faster than intersection.
+
+    """
+    minx, miny, maxx, maxy = geom.bounds
+    columns = range(floor(minx / tile_size), floor(maxx / tile_size) + 1)
+    for row in range(floor(miny / tile_size), floor(maxy / tile_size) + 1):
+        row_miny, row_maxy = row * tile_size, (row + 1) * tile_size
+        row_geom = clip_by_rect(geom, minx, row_miny, maxx, row_maxy)
+        if row_geom.is_empty:
+            continue
+        for column in columns:
+            parts = polygons(
+                clip_by_rect(
+                    row_geom,
+                    column * tile_size,
+                    row_miny,
+                    (column + 1) * tile_size,
+                    row_maxy,
+                )
+            )
+            if parts:
+                yield column, row, MultiPolygon(parts)
+
+
+def write_geometry(root_path, fid, geom, crs_wkt=None):
+    """ Write WKT, WKB and GeoJSON files of feature fid's geom to its Item directory
+
+    A GeoJSON simplified for each of SIMPLIFIED_RESOLUTIONS is written alongside the full
+    resolution one, as is a FlatGeobuf of geom split into TILE_SIZE tiles. FlatGeobuf files
+    have a spatial index of their features, so a chip sized query only reads a few tiles.
+
+    Returns the bbox and convex hull of geom, which is all the Item needs, so that when this
+    runs in a worker process only they are sent back rather than the full geometry.
+
+    """
+    shapely_geom = shape(geom)
+
+    os.makedirs("{}/{}".format(root_path, fid), exist_ok=True)
+
+    with open("{}/{}/{}-usfimr.wkt".format(root_path, fid, fid), "w") as wkt_file:
+        wkt_file.write(shapely_geom.wkt)
+
+    with open("{}/{}/{}-usfimr.wkb".format(root_path, fid, fid), "wb") as wkb_file:
+        wkb_file.write(shapely_geom.wkb)
+
+    with open(
+        "{}/{}/{}-usfimr.geojson".format(root_path, fid, fid), "w"
+    ) as geojson_file:
+        geojson_file.write(json.dumps(geom))
+
+    for resolution in SIMPLIFIED_RESOLUTIONS:
+        simplified_geom = shapely_geom.simplify(
+            simplify_tolerance(resolution), preserve_topology=True
+        )
+        with open(
+            "{}/{}/{}-usfimr-{}m.geojson".format(root_path, fid, fid, resolution), "w"
+        ) as geojson_file:
+            geojson_file.write(json.dumps(mapping(simplified_geom)))
+
+    with fiona.open(
+        "{}/{}/{}-usfimr.fgb".format(root_path, fid, fid),
+        "w",
+        driver="FlatGeobuf",
+        schema=FLATGEOBUF_SCHEMA,
+        crs_wkt=crs_wkt,
+    ) as fgb_file:
+        fgb_file.writerecords(
+            {
+                "geometry": mapping(tile_geom),
+                "properties": {"column": column, "row": row},
+            }
+            for column, row, tile_geom in split_into_tiles(shapely_geom)
+        )
+
+    return list(shapely_geom.bounds), mapping(shapely_geom.convex_hull)
+
+
+def map_features(features, root_path, processes=1, crs_wkt=None):
+    """ Yield (fid, properties, bbox, convex hull) for features, in order, using write_geometry
+
+    With more than one process, features are streamed to a pool of that many processes. At
+    most two features per process are in flight at once, so the shapefile is read no faster
+    than the pool can keep up with and large geometries don't pile up in memory.
+
+    """
+    if processes <= 1:
+        for feature in features:
+            yield (
+                feature["id"],
+                feature["properties"],
+                *write_geometry(root_path, feature["id"], feature["geometry"], crs_wkt),
+            )
+        return
+
+    with ProcessPoolExecutor(max_workers=processes) as executor:
+        pending = deque()
+        for feature in features:
+            future = executor.submit(
+                write_geometry, root_path, feature["id"], feature["geometry"], crs_wkt
+            )
+            pending.append((feature["id"], feature["properties"], future))
+            if len(pending) >= 2 * processes:
+                fid, props, future = pending.popleft()
+                yield (fid, props, *future.result())
+        while pending:
+            fid, props, future = pending.popleft()
+            yield (fid, props, *future.result())
+
+
 if __name__ == "__main__":
     parser = argparse.ArgumentParser()
     parser.add_argument("--shapefile", required=True)
+    parser.add_argument(
+        "--processes",
+        type=int,
+        default=1,
+        help="Number of processes to use for parsing feature geometries and writing their "
+        "WKT, WKB, GeoJSON and FlatGeobuf files. With 1 they are written by the main process",
+    )
+    parser.add_argument(
+        "--snapshot",
+        help="Also write every Item to this single file, as GeoParquet if it ends in .parquet "
+        "or else as newline delimited JSON",
+    )
     args = parser.parse_args()
 
     shp_path = args.shapefile
@@ -33,10 +204,9 @@ if __name__ == "__main__":
     running_start_dt = None
     running_end_dt = None
     with fiona.open(shp_path) as fc:
-        for feature in fc:
-            geom = feature["geometry"]
-            props = feature["properties"]
-
+        for fid, props, bbox, serializable_convex_hull in map_features(
+            fc, root_path, args.processes, fc.crs_wkt
+        ):
             if props["Start_Time"] is not None:
                 start_time = time.fromisoformat(props["Start_Time"])
             else:
@@ -51,10 +221,6 @@ if __name__ == "__main__":
                 date.fromisoformat(props["Flood_Date"]), start_time
             )
             end_dt = datetime.combine(date.fromisoformat(props["Flood_Date"]), end_time)
-            shapely_geom = shape(geom)
-            bbox = shapely_geom.bounds
-            bbox_list = [bbox[0], bbox[1], bbox[2], bbox[3]]
-
             running_spatial_extent = (
                 min(running_spatial_extent[0], bbox[0]),
                 max(running_spatial_extent[1], bbox[1]),
@@ -74,8 +240,6 @@ if __name__ == "__main__":
             else:
                 running_end_dt = end_dt
 
-            fid = feature["id"]
-
             binary_asset = Asset(
                 href="{}-usfimr.wkb".format(fid),
                 description="well known binary representation",
@@ -91,35 +255,38 @@ if __name__ == "__main__":
                 description="geojson representation",
                 media_type="application/geo+json",
             )
-            serializable_convex_hull = mapping(shapely_geom.convex_hull)
-            item = Item(
-                fid, serializable_convex_hull, bbox_list, start_dt, deepcopy(props)
-            )
+            item = Item(fid, serializable_convex_hull, bbox, start_dt, deepcopy(props))
             text_asset.set_owner(item)
             item.add_asset(key="wkt", asset=text_asset)
             binary_asset.set_owner(item)
             item.add_asset(key="wkb", asset=binary_asset)
             json_asset.set_owner(item)
             item.add_asset(key="geojson", asset=json_asset)
+            flatgeobuf_asset = Asset(
+                href="{}-usfimr.fgb".format(fid),
+                description="flatgeobuf representation split into tiles, with a spatial index",
+                media_type="application/vnd.flatgeobuf",
+                properties={"usfimr:tile_size": TILE_SIZE},
+            )
+            flatgeobuf_asset.set_owner(item)
+            item.add_asset(key="flatgeobuf", asset=flatgeobuf_asset)
+            for resolution in SIMPLIFIED_RESOLUTIONS:
+                simplified_json_asset = Asset(
+                    href="{}-usfimr-{}m.geojson".format(fid, resolution),
+                    description="geojson representation simplified for rasterizing onto "
+                    "{} m pixels".format(resolution),
+                    media_type="application/geo+json",
+                    properties={
+                        "usfimr:resolution": resolution,
+                        "usfimr:simplify_tolerance": simplify_tolerance(resolution),
+                    },
+                )
+                simplified_json_asset.set_owner(item)
+                item.add_asset(
+                    key="geojson_{}m".format(resolution), asset=simplified_json_asset
+                )
             items.append(item)
 
-            os.makedirs("{}/{}".format(root_path, fid), exist_ok=True)
-
-            with open(
-                "{}/{}/{}-usfimr.wkt".format(root_path, fid, fid), "w"
-            ) as wkt_file:
-                wkt_file.write(shapely_geom.wkt)
-
-            with open(
-                "{}/{}/{}-usfimr.wkb".format(root_path, fid, fid), "wb"
-            ) as wkb_file:
-                wkb_file.write(shapely_geom.wkb)
-
-            with open(
-                "{}/{}/{}-usfimr.geojson".format(root_path, fid, fid), "w"
-            ) as geojson_file:
-                geojson_file.write(json.dumps(geom))
-
     overall_extent = Extent(
         SpatialExtent(running_spatial_extent),
         TemporalExtent([[running_start_dt, running_end_dt]]),
@@ -140,3 +307,7 @@ if __name__ == "__main__":
         root_path, catalog_type=CatalogType.SELF_CONTAINED
     )
     print("Saved STAC Catalog {} to {}...".format(root_collection.id, root_path))
+
+    if args.snapshot:
+        write_snapshot(catalog_items(root_collection), args.snapshot)
+        print("Saved Item snapshot to {}...".format(args.snapshot))